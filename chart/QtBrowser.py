@@ -1,3 +1,5 @@
+import time
+import socket
 import logging
 import os, sys
 
@@ -14,9 +16,112 @@ from biosignalml import client
 from biosignalml.rdf.sparqlstore import StoreException
 
 from runchart import show_chart
+from repositories import repository, known_repository
 from ui.repo import Ui_SelectRepository
 
 
+PROBE_TTL = 300.0         # Seconds a link's probe result is used for
+
+
+class ProbeTask(QtCore.QRunnable):
+#=================================
+
+  def __init__(self, probe, url):
+  #------------------------------
+    super(ProbeTask, self).__init__()
+    self._probe = probe       # Keeps the QObject alive while we run
+    self._url = url
+
+  def run(self):
+  #-------------
+    store = None
+    try:
+      store = repository(self._url)
+      recording = store.get_recording(self._url)
+    except (StoreException, socket.error) as msg:
+      logging.debug("Cannot probe %s: %s", self._url, msg)
+      self._probe._probed.emit(self._url, (None, None), False)
+    except IOError as msg:    # From get_recording() when not a recording
+      if store is None:
+        logging.debug("Cannot probe %s: %s", self._url, msg)
+        self._probe._probed.emit(self._url, (None, None), False)
+      else:
+        self._probe._probed.emit(self._url, (store, None), True)
+    except Exception as msg:
+      logging.error("Cannot probe %s: %s", self._url, msg)
+      self._probe._probed.emit(self._url, (None, None), False)
+    else:
+      self._probe._probed.emit(self._url, (store, recording), True)
+
+
+class RecordingProbe(QtCore.QObject):
+#====================================
+  """
+  Find out, in the background, whether links into known repositories
+  refer to recordings, remembering the answer for each URL for
+  `PROBE_TTL` seconds, including that a URL isn't a recording. Probes
+  that fail to reach the repository aren't remembered, so are tried
+  again.
+  """
+
+  probed = QtCore.pyqtSignal(str, object)   # url, recording or None
+
+  _probed = QtCore.pyqtSignal(str, object, bool)  # From probe tasks
+
+  def __init__(self, parent=None):
+  #-------------------------------
+    super(RecordingProbe, self).__init__(parent)
+    self._results = { }       # url --> (expires, store, recording)
+    self._pending = set()
+    self._probed.connect(self._finished)
+
+  def result(self, url):
+  #---------------------
+    """
+    :return: A (store, recording) tuple for a URL that has been probed,
+      with `recording` None if it isn't a recording, or None if the
+      URL hasn't been probed or its result has expired.
+    """
+    result = self._results.get(url)
+    if result is None: return None
+    if result[0] <= time.time():
+      del self._results[url]
+      return None
+    return result[1:]
+
+  def probe(self, url):
+  #--------------------
+    """
+    Start probing a URL, unless it is being probed, has a result, or
+    isn't in a known repository.
+
+    :return: True if the URL has been or is being probed.
+    """
+    if not url or not known_repository(url): return False
+    if url not in self._pending and self.result(url) is None:
+      self._pending.add(url)
+      QtCore.QThreadPool.globalInstance().start(ProbeTask(self, url))
+    return True
+
+  def _finished(self, url, result, succeeded):
+  #-------------------------------------------
+    self._pending.discard(url)
+    if succeeded: self._results[url] = (time.time() + PROBE_TTL,) + result
+    self.probed.emit(url, result[1])
+
+
+_probe = None
+
+def recording_probe():
+#=====================
+  """
+  The probe shared by all of the browser's windows.
+  """
+  global _probe
+  if _probe is None: _probe = RecordingProbe()
+  return _probe
+
+
 class WebPage(QtWebKitWidgets.QWebPage):
 #=======================================
 
@@ -52,6 +157,7 @@ class WebView(QtWebKitWidgets.QWebView):
     closekey = QtWidgets.QShortcut(QtGui.QKeySequence.Close, self, activated=self.close)
     refresh = QtWidgets.QShortcut(QtGui.QKeySequence.Refresh, self, activated=self.reload)
     self.setPage(WebPage(self))
+    self.page().linkHovered.connect(self.link_hovered)
     self._charts = [ ]
     if repo is not None:
       self.load(QtCore.QUrl(repo))
@@ -69,20 +175,28 @@ class WebView(QtWebKitWidgets.QWebView):
     menu.addAction(self.pageAction(QtWebKitWidgets.QWebPage.Back))
     menu.addAction(self.pageAction(QtWebKitWidgets.QWebPage.Forward))
     menu.addAction(self.pageAction(QtWebKitWidgets.QWebPage.Reload))
-    try:  ## Check if link_url refers to a recording...
-      store = client.Repository(link_url)
-      recording = store.get_recording(link_url)
+    waiting = None
+    probe = recording_probe()
+    result = probe.result(link_url)
+    if result is None and probe.probe(link_url):   ## Does link_url refer to a recording?
       menu.addSeparator()
       action = menu.addAction('View Recording')
-    except StoreException as msg:
-      alert = QtWidgets.QMessageBox()
-      alert.setText(str(msg))
-      alert.exec_()
-    except IOError:
-      pass
+      action.setEnabled(False)
+      def enable_action(url, recording):
+        if url == link_url:
+          action.setEnabled(recording is not None)
+          action.setVisible(recording is not None)
+      waiting = enable_action
+      probe.probed.connect(waiting)
+    elif result is not None and result[1] is not None:
+      menu.addSeparator()
+      menu.addAction('View Recording')
     item = menu.exec_(self.mapToGlobal(pos))
+    if waiting is not None:
+      probe.probed.disconnect(waiting)
     if item:
-      if item.text() == 'View Recording':
+      if item.text() == 'View Recording' and probe.result(link_url) is not None:
+        (store, recording) = probe.result(link_url)
         chart = show_chart(store, recording)
         if chart is not None:
           self._charts.append(chart)
@@ -90,6 +204,10 @@ class WebView(QtWebKitWidgets.QWebView):
           chart.viewer.raise_()
           chart.viewer.activateWindow()
 
+  def link_hovered(self, link, title, content):
+  #--------------------------------------------
+    recording_probe().probe(str(link))
+
   def createWindow(self, type):
   #----------------------------
     if type == QtWebKitWidgets.QWebPage.WebBrowserWindow:
@@ -144,7 +262,7 @@ if __name__ == '__main__':
     if url.isValid():
       url = str(url.toString())
       try:
-        repo = client.Repository(url, str(input.username.text()), str(input.password.text()))
+        repo = repository(url, str(input.username.text()), str(input.password.text()))
         if repo.access_token is None:
           raise IOError("Invalid username/password")
         # Better to first check client.Repository.authenticated(url)
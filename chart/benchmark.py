@@ -0,0 +1,323 @@
+"""
+Benchmark chart painting with synthetic data.
+
+Runs headless, using Qt's `offscreen` platform unless another is set::
+
+  python benchmark.py [--suite quick|full] [--repeats N] [--backend image|qglwidget|vbo]
+                      [--save FILE] [--compare FILE] [--tolerance PERCENT]
+
+Starting from a base case, each of the number of points per plot (1e3
+to 1e8), the number of plots (1 to 256), the time zoom, the number of
+annotations and the number of events is varied in turn. For each case
+the average paint time, the number of trace vertices and events drawn,
+the memory used by plot data and the peak memory allocated while
+building and first painting the case are reported. Peak memory is
+traced with `tracemalloc`, so it counts Python and numpy allocations
+but not Qt's own, and isn't reported under Python 2.
+
+Results can be saved as a JSON baseline with ``--save``. ``--compare``
+checks results against a saved baseline and exits with status 1 when a
+case paints more than ``--tolerance`` percent slower, or draws a
+different number of vertices. Baselines are only comparable when made on
+the same machine with the same options.
+
+``--backend`` chooses what is painted. ``image`` (the default) draws
+the chart into a QImage, as when it's saved or served as a PNG. The
+other backends paint the chart widget itself, with all layers redrawn
+for each paint, and need an OpenGL context: ``qglwidget`` with the
+chart a QGLWidget, as by default, and ``vbo`` with the chart a
+QOpenGLWidget drawing traces from vertex buffers, as when
+``CHART_OPENGL_TRACES`` is set. Without a GPU, Mesa's llvmpipe software
+renderer can be used, for instance::
+
+  LIBGL_ALWAYS_SOFTWARE=1 QT_QPA_PLATFORM=xcb xvfb-run python benchmark.py --backend qglwidget --save qgl.json
+  LIBGL_ALWAYS_SOFTWARE=1 QT_QPA_PLATFORM=xcb xvfb-run python benchmark.py --backend vbo --save vbo.json
+
+Paint times of the two runs show whether vertex buffers are worth
+making the default.
+"""
+
+import os
+import sys
+import json
+import platform
+import argparse
+import timeit
+
+try:
+  import tracemalloc
+except ImportError:           # Python 2
+  tracemalloc = None
+
+BACKENDS = [ 'image', 'qglwidget', 'vbo' ]
+
+def _backend(argv):
+#==================
+  """ The ``--backend`` argument, needed before chartplot is imported. """
+  for n, arg in enumerate(argv):
+    if arg == '--backend' and n + 1 < len(argv): return argv[n + 1]
+    if arg.startswith('--backend='): return arg.split('=', 1)[1]
+  return 'image'
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+if _backend(sys.argv[1:]) == 'vbo':
+  os.environ['CHART_OPENGL_TRACES'] = '1'   # Chosen when chartplot is imported
+
+import numpy as np
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from biosignalml.data import DataSegment, UniformTimeSeries, TimeSeries
+
+from chartplot import ChartPlot, SignalPlot, EventPlot, textcache
+from gltrace import GL_RENDERER
+
+
+WIDTH  = 1200
+HEIGHT = 800
+
+RATE   = 500.0              # Of synthetic signals
+
+BASE = { 'points': 1e5, 'plots': 1, 'zoom': 1, 'annotations': 0, 'events': 0 }
+
+SUITES = {
+  'quick': { 'points':      [ 1e3, 1e4, 1e5, 1e6 ],
+             'plots':       [ 1, 4, 16 ],
+             'zoom':        [ 1, 10, 100 ],
+             'annotations': [ 0, 100 ],
+             'events':      [ 0, 1000, 100000 ] },
+  'full':  { 'points':      [ 1e3, 1e4, 1e5, 1e6, 1e7, 1e8 ],
+             'plots':       [ 1, 4, 16, 64, 256 ],
+             'zoom':        [ 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000 ],
+             'annotations': [ 0, 10, 100, 1000, 10000 ],
+             'events':      [ 0, 100, 10000, 1000000 ] },
+  }
+
+PARAMETERS = [ 'points', 'plots', 'zoom', 'annotations', 'events' ]
+
+
+def cases(suite):
+#================
+  """
+  Generate the cases of a suite, each as a dictionary of parameters,
+  varying one parameter at a time from the base case.
+  """
+  seen = set()
+  for name in PARAMETERS:
+    for value in SUITES[suite][name]:
+      case = dict(BASE)
+      case[name] = value
+      key = case_key(case)
+      if key not in seen:
+        seen.add(key)
+        yield case
+
+
+def case_key(case):
+#==================
+  return ' '.join('%s=%g' % (name, case[name]) for name in PARAMETERS)
+
+
+def make_chart(case):
+#====================
+  """
+  Create a chart with synthetic sine wave signals, events and annotations.
+  """
+  chart = ChartPlot()
+  chart.resize(WIDTH, HEIGHT)
+  points = int(case['points'])
+  duration = points/RATE
+  chart.setTimeRange(0.0, duration)
+  random = np.random.RandomState(0)
+  for n in range(int(case['plots'])):
+    id = str(n)
+    chart.addSignalPlot(id, 'sine %d' % n, 'mV')
+    data = np.sin(2.0*np.pi*(np.arange(points)/RATE + random.uniform()))
+    chart.appendData(id, DataSegment(0.0, UniformTimeSeries(data, rate=RATE)))
+  events = int(case['events'])
+  if events:
+    chart.addEventPlot('events', 'events', lambda c: (str(int(c)), 'Code %d' % c))
+    times = np.sort(random.uniform(0.0, duration, events))
+    codes = random.randint(0, 10, events).astype(np.float64)
+    chart.appendData('events', DataSegment(0.0, TimeSeries(codes, times)))
+  for n in range(int(case['annotations'])):
+    start = random.uniform(0.0, duration)
+    end = start + random.uniform(0.0, duration/20.0) if n % 2 else None
+    chart.addAnnotation('ann%d' % n, start, end, 'Annotation %d' % n, [])
+  chart.setTimeZoom(case['zoom'])
+  return chart
+
+
+def painter(chart, backend):
+#===========================
+  """
+  A function that paints the chart once, redrawing all of it. Widgets
+  have their framebuffer read back so that OpenGL drawing is finished.
+  """
+  if backend == 'vbo':
+    def paint():
+      chart._invalidate()
+      chart.grabFramebuffer()     # Renders, calling paintGL()
+    return paint
+  elif backend == 'qglwidget':
+    def paint():
+      chart._invalidate()
+      chart.repaint()
+      chart.grabFrameBuffer()
+    return paint
+  image = QtGui.QImage(WIDTH, HEIGHT, QtGui.QImage.Format_ARGB32_Premultiplied)
+  return lambda: chart._draw(image)
+
+
+def paint_time(chart, repeats, backend='image'):
+#===============================================
+  paint = painter(chart, backend)
+  paint()                   # Warm up
+  start = timeit.default_timer()
+  for n in range(repeats): paint()
+  return (timeit.default_timer() - start)/repeats
+
+
+def gl_renderer():
+#=================
+  """ The name of the current OpenGL context's renderer, e.g. `llvmpipe`. """
+  profile = QtGui.QOpenGLVersionProfile()
+  profile.setVersion(2, 0)
+  gl = QtGui.QOpenGLContext.currentContext().versionFunctions(profile)
+  if gl is None: return None
+  gl.initializeOpenGLFunctions()
+  return gl.glGetString(GL_RENDERER)
+
+
+def drawn(chart):
+#================
+  """
+  Count the trace vertices and events drawn by the last paint, along
+  with the memory, in bytes, holding plot data.
+  """
+  vertices = 0
+  events = 0
+  nbytes = 0
+  limit = 2*int(chart._plot_width + 0.5)
+  for (id, visible, plot) in chart._plotlist:
+    if isinstance(plot, SignalPlot):
+      nbytes += plot.envelope.nbytes
+      if visible:
+        (n, first, last) = plot.envelope.visible(chart._start, chart._end, limit)
+        vertices += last - first
+    elif isinstance(plot, EventPlot):
+      nbytes += plot._events.nbytes
+      if visible:
+        times = plot._events.column(0)
+        events += (np.searchsorted(times, chart._end, side='right')
+                 - np.searchsorted(times, chart._start, side='left'))
+  return (int(vertices), int(events), nbytes)
+
+
+def run_case(case, repeats, backend='image'):
+#===========================================
+  """
+  Build and paint a case, tracing memory allocated until the first
+  paint. Paints are timed with tracing stopped.
+  """
+  if tracemalloc is not None: tracemalloc.start()
+  chart = make_chart(case)
+  if backend != 'image': chart.show()     # Initialises OpenGL
+  painter(chart, backend)()
+  peak = None
+  if tracemalloc is not None:
+    peak = tracemalloc.get_traced_memory()[1]/(1024.0*1024.0)
+    tracemalloc.stop()
+  paint = paint_time(chart, repeats, backend)
+  (vertices, events, nbytes) = drawn(chart)
+  if backend != 'image': chart.close()
+  chart.deleteLater()
+  QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+  return { 'paint_ms': 1000.0*paint, 'vertices': vertices, 'events': events,
+           'data_mb': nbytes/(1024.0*1024.0), 'peak_mb': peak }
+
+
+def compare(results, baseline, tolerance):
+#=========================================
+  """
+  Compare results with a baseline.
+
+  :return: A list of messages describing regressions.
+  """
+  regressions = []
+  for key, result in results.items():
+    base = baseline.get(key)
+    if base is None: continue
+    if result['paint_ms'] > base['paint_ms']*(1.0 + tolerance/100.0):
+      regressions.append('%s: paint %.3f ms, was %.3f ms'
+                         % (key, result['paint_ms'], base['paint_ms']))
+    if result['vertices'] != base['vertices']:
+      regressions.append('%s: %d vertices drawn, was %d'
+                         % (key, result['vertices'], base['vertices']))
+  return regressions
+
+
+if __name__ == '__main__':
+#=========================
+
+  parser = argparse.ArgumentParser(description="Benchmark chart painting")
+  parser.add_argument('--suite', choices=sorted(SUITES), default='quick', help="Cases to run")
+  parser.add_argument('--repeats', type=int, default=10, help="Paints to average over")
+  parser.add_argument('--backend', choices=BACKENDS, default='image', help="What to paint")
+  parser.add_argument('--save', metavar='FILE', help="Save results as a baseline")
+  parser.add_argument('--compare', metavar='FILE', help="Compare results with a baseline")
+  parser.add_argument('--tolerance', type=float, default=25.0,
+                      help="Percentage paint time increase allowed when comparing")
+  args = parser.parse_args()
+
+  app = QtWidgets.QApplication(sys.argv)
+
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+    if baseline.get('backend', 'image') != args.backend:
+      sys.exit("Baseline was made with the %s backend" % baseline.get('backend', 'image'))
+    baseline = baseline['results']
+
+  if args.backend != 'image':
+    chart = ChartPlot()
+    chart.show()
+    if args.backend == 'vbo':
+      chart.grabFramebuffer()
+      if chart._gltraces is None: sys.exit("OpenGL traces are not available")
+    elif not chart.isValid():
+      sys.exit("OpenGL is not available")
+    chart.makeCurrent()
+    print('OpenGL renderer: %s' % gl_renderer())
+    chart.doneCurrent()
+    chart.close()
+    del chart
+
+  print('%s suite, %d repeats, %s backend' % (args.suite, args.repeats, args.backend))
+  print('%-56s %10s %9s %9s %9s %9s %9s' % ('case', 'paint (ms)', 'baseline', 'vertices',
+                                           'events', 'data (MB)', 'peak (MB)'))
+  results = {}
+  for case in cases(args.suite):
+    key = case_key(case)
+    result = run_case(case, args.repeats, args.backend)
+    results[key] = result
+    base = baseline.get(key) if baseline else None
+    print('%-56s %10.3f %9s %9d %9d %9.1f %9s'
+          % (key, result['paint_ms'], '%.3f' % base['paint_ms'] if base else '-',
+             result['vertices'], result['events'], result['data_mb'],
+             '%.1f' % result['peak_mb'] if result['peak_mb'] is not None else '-'))
+    sys.stdout.flush()
+  print('Text cache hit rate: %.1f%%' % (100.0*textcache.hitRate()))
+
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump({ 'suite': args.suite, 'repeats': args.repeats, 'backend': args.backend,
+                  'platform': platform.platform(), 'python': platform.python_version(),
+                  'qt': QtCore.QT_VERSION_STR, 'results': results },
+                f, indent=2, sort_keys=True)
+
+  if baseline is not None:
+    regressions = compare(results, baseline, args.tolerance)
+    for r in regressions: print('REGRESSION %s' % r)
+    if regressions: sys.exit(1)
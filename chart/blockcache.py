@@ -0,0 +1,151 @@
+"""
+A least recently used cache of signal data, held in aligned blocks.
+
+A signal's timeline is divided into fixed length blocks, starting at
+time zero, so that overlapping views of a recording share blocks.
+Blocks are keyed by (signal URI, block start, resolution, duration),
+where the resolution is the rate at which data was read, and are
+evicted least recently used first when the cache's memory limit is
+reached. Blocks are no longer than the window being viewed, so that a
+short window doesn't read much more data than it shows.
+
+A cache may be backed by a :class:`~diskcache.DiskCache`, so that blocks
+are kept between sessions.
+"""
+
+import math
+import threading
+import collections
+
+import numpy as np
+
+from biosignalml.data import DataSegment, TimeSeries
+
+
+BLOCK_POINTS   = 65536          # Samples in a block of a uniformly sampled signal
+BLOCK_DURATION = 60.0           # Seconds in a block of other signals
+
+CACHE_SIZE     = 256*1024*1024  # Bytes
+
+POINT_SIZE     = 16             # Bytes of a (time, value) point
+
+
+def block_duration(rate, window=None):
+#=====================================
+  """
+  The duration of blocks for a signal sampled at `rate`, or for
+  irregularly sampled signals if `rate` is None.
+
+  :param window: The duration of the window being read. Blocks are no
+    longer than this, rounded down to a power of two so that windows of
+    similar durations share blocks.
+  """
+  duration = BLOCK_POINTS/float(rate) if rate else BLOCK_DURATION
+  if window: duration = min(duration, 2.0**math.floor(math.log(window, 2)))
+  return duration
+
+
+def block_starts(start, end, duration):
+#======================================
+  """
+  The start times of the blocks covering `start` up to `end`.
+  """
+  n = int(math.floor(start/duration))
+  while n*duration < end:
+    yield n*duration
+    n += 1
+
+
+class BlockCache(object):
+#========================
+  """
+  A thread safe cache of blocks, each a list of DataSegments.
+
+  :param size: The maximum total size, in bytes, of cached blocks.
+  :param disk: A :class:`~diskcache.DiskCache` to also keep blocks in.
+  :param recording: The URI of the recording whose blocks are cached,
+    to identify them on disk.
+  """
+
+  def __init__(self, size=CACHE_SIZE, disk=None, recording=None):
+  #--------------------------------------------------------------
+    self._disk = disk
+    self._recording = recording
+    self._size = size
+    self._used = 0
+    self._blocks = collections.OrderedDict()   # key --> (segments, bytes)
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+  #-----------------
+    return len(self._blocks)
+
+  @property
+  def size(self):
+  #--------------
+    return self._size
+
+  @property
+  def used(self):
+  #--------------
+    return self._used
+
+  def __contains__(self, key):
+  #---------------------------
+    return (key in self._blocks
+         or (self._disk is not None and (self._recording, key) in self._disk))
+
+  def get(self, key):
+  #------------------
+    """
+    Get a block, as a list of DataSegments, or None if it's not cached.
+    """
+    with self._lock:
+      block = self._blocks.pop(key, None)
+      if block is not None:
+        self._blocks[key] = block
+        self.hits += 1
+        return block[0]
+    points = self._disk.get(self._recording, key) if self._disk is not None else None
+    if points is None:
+      self.misses += 1
+      return None
+    # Views of the memory-mapped file, not copies
+    segments = [ DataSegment(0.0, TimeSeries(points[:, 1], points[:, 0])) ] if len(points) else [ ]
+    self._put(key, segments)
+    self.hits += 1
+    return segments
+
+  def put(self, key, segments):
+  #----------------------------
+    """
+    Cache a block.
+
+    :return: The block's size in bytes, or zero if it's too large to cache.
+    """
+    if self._disk is not None:
+      points = (np.concatenate([ d.points for d in segments ]) if segments
+                else np.empty((0, 2), dtype=np.float64))
+      self._disk.put(self._recording, key, points)
+    return self._put(key, segments)
+
+  def _put(self, key, segments):
+  #-----------------------------
+    size = POINT_SIZE*sum(len(d) for d in segments)
+    if size > self._size: return 0
+    with self._lock:
+      previous = self._blocks.pop(key, None)
+      if previous is not None: self._used -= previous[1]
+      while self._blocks and (self._used + size) > self._size:
+        self._used -= self._blocks.popitem(last=False)[1][1]
+      self._blocks[key] = (segments, size)
+      self._used += size
+    return size
+
+  def clear(self):
+  #---------------
+    with self._lock:
+      self._blocks.clear()
+      self._used = 0
@@ -1,3 +1,4 @@
+import os
 import math
 import logging
 import collections
@@ -10,26 +11,38 @@ from biosignalml.data import DataSegment
 
 from nrange import NumericRange
 from annotation import AnnotationDialog
+from decimate import ColumnBuffer, MinMaxPyramid, spliced
+from gltrace import GLTraces
 
 ##ChartWidget = QtWidgets.QWidget   # Hangs if > 64K points
-ChartWidget = QtOpenGL.QGLWidget    # Faster, anti-aliasing not quite as good QWidget
+## Drawing traces from vertex buffers, in a QOpenGLWidget, is opt-in until
+## it has been benchmarked against QGLWidget, including under llvmpipe,
+## using `benchmark.py --backend vbo` and `--backend qglwidget`.
+## Headless rendering, where there may be no OpenGL context, draws
+## through image() using a plain widget.
+if os.environ.get('CHART_OPENGL_TRACES'):
+  ChartWidget = QtWidgets.QOpenGLWidget   # Traces drawn from vertex buffers, if OpenGL 2.0 is available
+elif os.environ.get('CHART_NO_OPENGL'):
+  ChartWidget = QtWidgets.QWidget
+else:
+  ChartWidget = QtOpenGL.QGLWidget      # Faster, anti-aliasing not quite as good QWidget
 
 
 try:
 ## Borrowed from http://home.gna.org/veusz/
   from veusz.qtloops import addNumpyToPolygonF
 
-  def make_polygon(points):
-  #------------------------
+  def make_polygon(x, y):
+  #----------------------
     poly = QtGui.QPolygonF()
-    addNumpyToPolygonF(poly, points[..., 0], points[..., 1])
+    addNumpyToPolygonF(poly, x, y)
     return poly
 
 except ImportError:
 
-  def make_polygon(points):
-  #------------------------
-    return QtGui.QPolygonF([QtCore.QPointF(pt[0], pt[1]) for pt in points])
+  def make_polygon(x, y):
+  #----------------------
+    return QtGui.QPolygonF([QtCore.QPointF(*pt) for pt in zip(x, y)])
 
 
 # Margins of plotting region within chart, in pixels
@@ -51,6 +64,8 @@ selectEdgeColour = QtGui.QColor('cyan')
 selectTimeColour = QtGui.QColor('black')
 selectLenColour  = QtGui.QColor('darkRed')
 
+EVENT_DENSITY    = 3                               ## Events per pixel before showing density
+
 ANN_START        = 20                              ## Pixels from top to first bar
 ANN_LINE_WIDTH   = 8
 ANN_LINE_GAP     = 2
@@ -65,11 +80,92 @@ alignBottom      = 0x08
 alignMiddle      = 0x0C
 alignCentred     = 0x0F
 
+LAYER_ANNOTATIONS = 'annotations'                   ## Cached layers of a chart
+LAYER_TRACES      = 'traces'
+
+
+TEXT_CACHE_SIZE  = 4096                            ## Laid out strings to keep
+
+
+class TextCache(object):
+#=======================
+  """
+  A least recently used cache of laid out text for :func:`drawtext`.
+
+  Entries are keyed by text, font and alignment and hold a prepared
+  :class:`QtGui.QStaticText` for each line of the text, along with the
+  line's offset from the point the text is aligned to.
+
+  :param size: The maximum number of entries to keep.
+  """
+
+  def __init__(self, size=TEXT_CACHE_SIZE):
+  #----------------------------------------
+    self._size = size
+    self._entries = collections.OrderedDict()
+    self._fonts = {}
+    self.hits = 0
+    self.misses = 0
+
+  def hitRate(self):
+  #-----------------
+    lookups = self.hits + self.misses
+    return float(self.hits)/lookups if lookups else 0.0
+
+  def font(self, font, size, weight):
+  #----------------------------------
+    key = (font.key(), size, weight)
+    newfont = self._fonts.get(key)
+    if newfont is None:
+      newfont = QtGui.QFont(font)
+      if size: newfont.setPointSize(size)
+      if weight: newfont.setWeight(weight)
+      self._fonts[key] = newfont
+    return newfont
+
+  def layout(self, text, font, align):
+  #-----------------------------------
+    key = (text, font.key(), align)
+    entry = self._entries.pop(key, None)
+    if entry is None:
+      self.misses += 1
+      entry = self._layout(text, font, align)
+      if len(self._entries) >= self._size:
+        self._entries.popitem(last=False)
+    else:
+      self.hits += 1
+    self._entries[key] = entry
+    return entry
+
+  @staticmethod
+  def _layout(text, font, align):
+  #------------------------------
+    lines = text.split('\n')
+    metrics = QtGui.QFontMetricsF(font)
+    th = (metrics.xHeight() + metrics.ascent())/2.0  # Compromise...
+    adjust = (len(lines)-1)*metrics.height()  ## lineSpacing()
+    if   (align & alignMiddle) == alignMiddle: ty = (th-adjust)/2.0
+    elif (align & alignTop)    == alignTop:    ty = th
+    else:                                      ty = -adjust
+    layout = []
+    for t in lines:
+      tw = metrics.width(t)
+      if   (align & alignCentre) == alignCentre: tx = -tw/2.0
+      elif (align & alignRight)  == alignRight:  tx = -tw
+      else:                                      tx = 0.0
+      static = QtGui.QStaticText(t)
+      static.setTextFormat(QtCore.Qt.PlainText)
+      static.prepare(QtGui.QTransform(), font)
+      layout.append((tx, ty - metrics.ascent(), static))  # Static text is positioned by its top
+      ty += metrics.height()                  ## lineSpacing()
+    return layout
+
+textcache = TextCache()
+
 
 def drawtext(painter, x, y, text, mapX=True, mapY=True, align=alignCentred, fontSize=None, fontWeight=None):
 #-----------------------------------------------------------------------------------------------------------
   if not text: return
-  lines = text.split('\n')
   xfm = painter.transform()
   if mapX or mapY:
     pt = xfm.map(QtCore.QPointF(x, y))  # Assume affine mapping
@@ -78,27 +174,30 @@ def drawtext(painter, x, y, text, mapX=True, mapY=True, align=alignCentred, font
   painter.resetTransform()
   font = painter.font()
   if fontSize is not None or fontWeight is not None:
-    newfont = QtGui.QFont(font)
-    if fontSize: newfont.setPointSize(fontSize)
-    if fontWeight: newfont.setWeight(fontWeight)
-    painter.setFont(newfont)
-  metrics = painter.fontMetrics()
-  th = (metrics.xHeight() + metrics.ascent())/2.0  # Compromise...
-  adjust = (len(lines)-1)*metrics.height()  ## lineSpacing()
-  if   (align & alignMiddle) == alignMiddle: ty = y + (th-adjust)/2.0
-  elif (align & alignTop)    == alignTop:    ty = y + th
-  else:                                      ty = y - adjust
-  for t in lines:
-    tw = metrics.width(t)
-    if   (align & alignCentre) == alignCentre: tx = x - tw/2.0
-    elif (align & alignRight)  == alignRight:  tx = x - tw
-    else:                                      tx = x
-    painter.drawText(QtCore.QPointF(tx, ty), t)
-    ty += metrics.height()                  ## lineSpacing()
+    painter.setFont(textcache.font(font, fontSize, fontWeight))
+  for (tx, ty, static) in textcache.layout(text, painter.font(), align):
+    painter.drawStaticText(QtCore.QPointF(x + tx, y + ty), static)
   painter.setFont(font)             # Reset, in case changed above
   painter.setTransform(xfm)
 
 
+def segment_points(segments):
+#=============================
+  """
+  Join the points of a list of DataSegments.
+
+  :return: A tuple of (times, values) arrays, in time order.
+  """
+  points = [ d.points for d in segments if len(d) ]
+  if not points: return (np.empty(0), np.empty(0))
+  times = np.concatenate([ p[..., 0] for p in points ])
+  values = np.concatenate([ p[..., 1] for p in points ])
+  if len(points) > 1 and np.any(times[1:] < times[:-1]):
+    order = np.argsort(times, kind='mergesort')
+    (times, values) = (times[order], values[order])
+  return (times, values)
+
+
 class SignalPlot(object):
 #========================
   """
@@ -117,8 +216,7 @@ class SignalPlot(object):
   #-------------------------------------
     self._ymin = ymin
     self._ymax = ymax
-    self._poly = QtGui.QPolygonF()
-    self._path = QtGui.QPainterPath()
+    self._envelope = MinMaxPyramid()   # Also holds the samples
 
   def _setYrange(self):
   #--------------------
@@ -137,6 +235,17 @@ class SignalPlot(object):
   #--------------------
     return self._range.major_size
 
+  @property
+  def envelope(self):
+  #------------------
+    return self._envelope
+
+  def _extendYrange(self, ymin, ymax):
+  #-----------------------------------
+    if self._ymin == None or self._ymin > ymin: self._ymin = ymin
+    if self._ymax == None or self._ymax < ymax: self._ymax = ymax
+    self._setYrange()
+
   def appendData(self, data, ymin=None, ymax=None):
   #------------------------------------------------
     if len(data) == 0:
@@ -144,14 +253,33 @@ class SignalPlot(object):
       return
     if ymin is None: ymin = np.amin(data.data)
     if ymax is None: ymax = np.amax(data.data)
-    if self._ymin == None or self._ymin > ymin: self._ymin = ymin
-    if self._ymax == None or self._ymax < ymax: self._ymax = ymax
-    self._setYrange()
-    poly = make_polygon(data.points)
-    path = QtGui.QPainterPath()
-    path.addPolygon(poly)
-    self._path.connectPath(path)
-    self._poly += poly
+    self._extendYrange(ymin, ymax)
+    points = data.points
+    self._envelope.splice(points[..., 0], points[..., 1])
+
+  def spliceData(self, segments, start=None, end=None):
+  #----------------------------------------------------
+    """
+    Insert a batch of DataSegments, replacing any data from `start` up
+    to `end`, rebuilding the envelope at most once.
+    """
+    (times, values) = segment_points(segments)
+    if len(values): self._extendYrange(np.amin(values), np.amax(values))
+    self._envelope.splice(times, values, start, end)
+
+  def trim(self, start, end):
+  #--------------------------
+    """
+    Only keep data from `start` up to `end`.
+    """
+    self._envelope.trim(start, end)
+
+  def cut(self, start, end):
+  #-------------------------
+    """
+    Remove data from `start` up to `end`.
+    """
+    self._envelope.cut(start, end)
 
   def yValue(self, time):
   #----------------------
@@ -160,44 +288,48 @@ class SignalPlot(object):
     """
     i = self._index(time)
     if i is not None:
-      if i >= (self._poly.size() - 1):
-        i = self._poly.size() - 2
-      p0 = self._poly.at(i)
-      p1 = self._poly.at(i+1)
-      if p0.x() == p1.x(): return (p0.y() + p1.y())/2.0
-      return p0.y() + (time - p0.x())*(p1.y() - p0.y())/(p1.x() - p0.x())
+      times = self._envelope.times
+      values = self._envelope.values
+      if i >= (len(times) - 1):
+        i = len(times) - 2
+      if i < 0: return float(values[0])
+      (t0, t1) = (times[i], times[i+1])
+      (y0, y1) = (float(values[i]), float(values[i+1]))
+      if t0 == t1: return (y0 + y1)/2.0
+      return y0 + (time - t0)*(y1 - y0)/(t1 - t0)
 
   def _index(self, time):
   #----------------------
-    i = 0
-    j = self._poly.size()
-    if (time < self._poly.at(0).x()
-     or time > self._poly.at(j-1).x()): return None
-    while i < j:
-      m = (i + j)//2
-      if self._poly.at(m).x() <= time: i = m + 1
-      else:                            j = m
-    return i - 1
+    times = self._envelope.times
+    if (len(times) == 0
+     or time < times[0]
+     or time > times[-1]): return None
+    return int(np.searchsorted(times, time, side='right')) - 1
 
   def yPosition(self, timepos):
   #----------------------------
     return None
 
-  def drawTrace(self, painter, start, end, endlabels=False, labelfreq=1, markers=None):
-  #------------------------------------------------------------------------------------
+  def _scaleY(self, painter):
+  #--------------------------
+    painter.scale(1.0, 1.0/(self.ymax - self.ymin))
+    painter.translate(0.0, -self.ymin)
+
+  def drawTrace(self, painter, start, end, endlabels=False, labelfreq=1, trace=True):
+  #----------------------------------------------------------------------------------
     """
     Draw the trace.
 
     :param painter: The QPainter to use for drawing.
     :param start: The leftmost position on the X-axis.
     :param end: The rightmost position on the X-axis.
+    :param trace: Set False to only draw and label y-gridlines, when
+      the trace itself is drawn using OpenGL.
 
     The painter has been scaled so that (0.0, 1.0) is the
     vertical plotting height.
     """
-    if self._path is None: return
-    painter.scale(1.0, 1.0/(self.ymax - self.ymin))
-    painter.translate(0.0, -self.ymin)
+    self._scaleY(painter)
     # draw and label y-gridlines.
     n = 0
     y = self.ymin
@@ -213,80 +345,272 @@ class SignalPlot(object):
       y += self._range.major
       if -1e-10 < y < 1e-10: y = 0.0  #####
       n += 1
+    if not trace: return
     painter.setClipping(True)
     painter.setPen(QtGui.QPen(traceColour if not self.selected else selectedColour, 0))
-    # Could find start/end indices and only draw segment
-    # rather than rely on clipping...
-    painter.drawPath(self._path)
-    #painter.drawPolyline(QtGui.QPolygonF(self._points))
-    # But very fast as is, esp. when using OpenGL
+    # Only draw the visible segment of the envelope level giving
+    # about two vertices per pixel column, so that cost depends on
+    # width and not on data size or zoom. Clipping is still needed
+    # for the padding vertex at each end.
+    width = abs(painter.transform().m11())*(end - start)
+    (times, values) = self._envelope.vertices(start, end, 2*int(width + 0.5))
+    if len(times): painter.drawPolyline(make_polygon(times, values))
     painter.setClipping(False)
-    if markers:
-      xfm = painter.transform()
-      for n, t in enumerate(markers):
-         painter.setPen(QtGui.QPen(markerColour if n == 0 else marker2Colour, 0))
-         y = self.yValue(t)
-         if y is not None:
-           y = self._range.map(y, extra=1)
-           xy = xfm.map(QtCore.QPointF(t, y))
-           drawtext(painter, xy.x()+5, xy.y(), str(y), mapX=False, mapY=False, align=alignLeft)
+
+  def drawMarkers(self, painter, markers):
+  #---------------------------------------
+    """
+    Show the trace's value at each marker's time.
+
+    The painter is set up as for :meth:`drawTrace`.
+    """
+    self._scaleY(painter)
+    xfm = painter.transform()
+    for n, t in enumerate(markers):
+       painter.setPen(QtGui.QPen(markerColour if n == 0 else marker2Colour, 0))
+       y = self.yValue(t)
+       if y is not None:
+         y = self._range.map(y, extra=1)
+         xy = xfm.map(QtCore.QPointF(t, y))
+         drawtext(painter, xy.x()+5, xy.y(), str(y), mapX=False, mapY=False, align=alignLeft)
 
 
 class EventPlot(object):
 #=======================
   """
   A single event trace.
+
+  Event times and codes are kept in time order in a :class:`ColumnBuffer`
+  so that only those in the visible window are drawn. When there are
+  more than ``EVENT_DENSITY`` events per pixel column, a strip showing
+  event density is drawn instead of individual events, with the first
+  marked event in each column being remembered so that its description
+  can still be shown.
   """
   def __init__(self, label, mapping=lambda x: (str(x), str(x)), data=None):
   #------------------------------------------------------------------------
     self.label = label
     self.selected = False
     self._mapping = mapping
+    self._labels = { }      # code --> (mark, description)
     self.reset()
     self.gridheight = 2   ###
     if data: self.appendData(data)
 
   def reset(self):
   #---------------
-    self._events = [ ]
-    self._eventpos = []
+    self._events = ColumnBuffer((np.float64, np.float64))   # (time, code)
+    self._eventpos = np.empty(0, dtype=np.int64)  # Pixel positions of labelled events drawn
+    self._eventidx = np.empty(0, dtype=np.intp)   # and their index in _events
+
+  def _label(self, code):
+  #----------------------
+    label = self._labels.get(code)
+    if label is None:
+      label = self._mapping(code)
+      self._labels[code] = label
+    return label
 
   def yPosition(self, timepos):
   #----------------------------
-    timepos = int(timepos+0.5) + 3                          ## "close to"
-    i = 0
-    j = len(self._eventpos)
-    if j == 0 or timepos < self._eventpos[0][0]: return None
-    while i < j:
-      m = (i + j)//2
-      if self._eventpos[m][0] <= timepos: i = m + 1
-      else:                               j = m
-    timepos -= 3
-    if (timepos-3) <= self._eventpos[i-1][0] < (timepos+3): ## "close to"
-      return self._eventpos[i-1][2]
+    timepos = int(timepos+0.5)
+    i = np.searchsorted(self._eventpos, timepos + 3, side='right')
+    if i > 0 and (timepos-3) <= self._eventpos[i-1] < (timepos+3): ## "close to"
+      code = self._events.column(1)[self._eventidx[i-1]]
+      return '\n'.join(self._label(code)[1].split())
 
   def appendData(self, data):
   #--------------------------
     if len(data) == 0:
       self.reset()
+      return
+    self.spliceData([ data ])
+
+  def spliceData(self, segments, start=None, end=None):
+  #----------------------------------------------------
+    """
+    Insert a batch of DataSegments, replacing any events from `start`
+    up to `end`.
+    """
+    (times, codes) = segment_points(segments)
+    kept = spliced(self._events.column(0), self._events.column(1), times, codes, start, end)
+    if kept is None:
+      self._events.append(times, codes)
     else:
-      self._events.extend([ (pt[0], self._mapping(pt[1])) for pt in data.points ])
+      self._events.clear()
+      self._events.append(*kept)
+      self._eventpos = np.empty(0, dtype=np.int64)
+      self._eventidx = np.empty(0, dtype=np.intp)
 
-  def drawTrace(self, painter, start, end, markers=None, **kwds):
-  #--------------------------------------------------------------
-    if not self._events: return
+  def trim(self, start, end):
+  #--------------------------
+    """
+    Only keep events from `start` up to `end`.
+    """
+    times = self._events.column(0)
+    first = np.searchsorted(times, start, side='left')
+    last = np.searchsorted(times, end, side='left')
+    if first == 0 and last == len(times): return
+    kept = (times[first:last].copy(), self._events.column(1)[first:last].copy())
+    self._events.clear()
+    self._events.append(*kept)
+    self._eventpos = np.empty(0, dtype=np.int64)
+    self._eventidx = np.empty(0, dtype=np.intp)
+
+  def cut(self, start, end):
+  #-------------------------
+    """
+    Remove events from `start` up to `end`.
+    """
+    times = self._events.column(0)
+    first = np.searchsorted(times, start, side='left')
+    last = np.searchsorted(times, end, side='left')
+    if first == last: return
+    codes = self._events.column(1)
+    kept = (np.concatenate((times[:first], times[last:])),
+            np.concatenate((codes[:first], codes[last:])))
+    self._events.clear()
+    self._events.append(*kept)
+    self._eventpos = np.empty(0, dtype=np.int64)
+    self._eventidx = np.empty(0, dtype=np.intp)
+
+  def drawTrace(self, painter, start, end, **kwds):
+  #-------------------------------------------------
+    times = self._events.column(0)
+    first = np.searchsorted(times, start, side='left')
+    last = np.searchsorted(times, end, side='right')
+    self._eventpos = np.empty(0, dtype=np.int64)
+    self._eventidx = np.empty(0, dtype=np.intp)
+    if first == last: return
     painter.setClipping(True)
-    self._eventpos = []
-    for t, event in self._events:
-      if event[0]:
+    xfm = painter.transform()
+    width = abs(xfm.m11())*(end - start)
+    codes = self._events.column(1)[first:last]
+    (unique, inverse) = np.unique(codes, return_inverse=True)
+    marked = np.array([ bool(self._label(c)[0]) for c in unique ])[inverse]
+    index = first + np.nonzero(marked)[0]
+    positions = np.floor(times[index]*xfm.m11() + xfm.dx() + 0.5).astype(np.int64)
+    if (last - first) > EVENT_DENSITY*width:
+      self._drawDensity(painter, times[first:last], start, end, int(width + 0.5))
+      # Keep the first marked event in each pixel column so its description can be shown
+      (positions, firsts) = np.unique(positions, return_index=True)
+      index = index[firsts]
+    else:
+      for n in index:
+        t = times[n]
         painter.setPen(QtGui.QPen(traceColour if not self.selected else selectedColour, 0))
         painter.drawLine(QtCore.QPointF(t, 0.0), QtCore.QPointF(t, 1.0))
         painter.setPen(QtGui.QPen(textColour, 0))
-        drawtext(painter, t, 0.5, event[0])
-        xy = painter.transform().map(QtCore.QPointF(t, 0.5))
-        self._eventpos.append( (int(xy.x()+0.5), int(xy.y()+0.5), '\n'.join(event[1].split())) )
+        drawtext(painter, t, 0.5, self._label(codes[n - first])[0])
+    self._eventpos = positions
+    self._eventidx = index
     painter.setClipping(False)
 
+  def _drawDensity(self, painter, times, start, end, columns):
+  #----------------------------------------------------------
+    """
+    Draw a vertical line in each pixel column with height
+    proportional to the number of events in the column.
+    """
+    (counts, edges) = np.histogram(times, bins=max(1, columns), range=(start, end))
+    heights = counts/float(counts.max())
+    painter.setPen(QtGui.QPen(traceColour if not self.selected else selectedColour, 0))
+    for n in np.nonzero(counts)[0]:
+      t = (edges[n] + edges[n+1])/2.0
+      painter.drawLine(QtCore.QPointF(t, 0.0), QtCore.QPointF(t, heights[n]))
+
+  def drawMarkers(self, painter, markers):
+  #---------------------------------------
+    pass    # Event descriptions are shown alongside the plot's label
+
+
+class AnnotationLayout(object):
+#==============================
+  """
+  The rows and colours of a chart's annotation bars.
+
+  Bars are packed into rows, in time order, starting from the top and
+  not stepping down a row if a bar starts after the previous bar in a
+  row ends. The same colour is used for annotations having the same
+  text, with adjacent bars being given different colours.
+
+  Layout is only done after annotations have changed, rather than
+  each time the chart is drawn. The bars in a row never overlap, so
+  each row's start and end times form a sorted index in which the bar
+  at a given time is found by binary search.
+  """
+
+  def __init__(self):
+  #------------------
+    self.reset()
+
+  def reset(self):
+  #---------------
+    """ Mark the layout as needing to be redone. """
+    self.bars = None        # List of tuple(start, end, row, colour, id)
+    self._rows = []         # tuple(starts, ends, ids) for each row
+
+  def update(self, annotations, display_text):
+  #-------------------------------------------
+    """
+    Layout annotations if they have changed.
+
+    :param annotations: A dictionary of tuple(start, end, text, tags, editable)
+      keyed by annotation id.
+    :param display_text: A function giving the text used to match
+      colours of an annotation tuple.
+    """
+    if self.bars is not None: return
+    self.bars = []
+    rows = []                # Bars of each row
+    endtimes = []            # [endtime, colour] pair for each row
+    nextcolour = 0
+    colourdict = {}          # key by text, to use the same colour for the same text
+    for ann, id in sorted([ (ann, id)
+                            for id, ann in annotations.items() ]):
+      row = None
+      colours = [ None, None, None ]   # On left, above, below
+      for n, e in enumerate(endtimes):
+        if ann[0] > e[0]:     # Start time after last end on this row?
+          row = n
+          e[0] = ann[1]       # Save end time
+          colours[0] = e[1]
+          if (n + 1) < len(endtimes):
+            colours[2] = endtimes[n+1][1]
+          break
+        colours[1] = e[1]
+      if row is None:
+        row = len(endtimes)
+        endtimes.append([ann[1], None])
+        rows.append([])
+      text = display_text(ann)
+      thiscolour = colourdict.get(text, None)
+      if thiscolour is None:
+        used = [ c for c in colours if c is not None ]
+        thiscolour = nextcolour
+        while thiscolour in used:      # Must terminate since len(ANN_COLOURS) > len(used)
+          thiscolour = (thiscolour + 1) % len(ANN_COLOURS)
+        nextcolour = (nextcolour + 1) % len(ANN_COLOURS)
+        colourdict[text] = thiscolour
+      endtimes[row][1] = thiscolour  # Save colour index
+      self.bars.append((ann[0], ann[1], row, thiscolour, id))
+      rows[row].append((ann[0], ann[1], id))
+    self._rows = [ (np.array([b[0] for b in r]), np.array([b[1] for b in r]), [b[2] for b in r])
+                     for r in rows ]
+
+  def find(self, row, time, tolerance=0.0):
+  #----------------------------------------
+    """
+    Find the bar in a row that is at a time.
+
+    :return: The annotation's id, or None.
+    """
+    if 0 <= row < len(self._rows):
+      (starts, ends, ids) = self._rows[row]
+      i = np.searchsorted(starts, time + tolerance, side='right') - 1
+      for n in [i, i - 1]:
+        if n >= 0 and (time - tolerance) <= ends[n]: return ids[n]
+
 
 class ChartPlot(ChartWidget):
 #============================
@@ -296,6 +620,7 @@ class ChartPlot(ChartWidget):
 
   """
   chartPosition = QtCore.pyqtSignal(int, int, int)
+  timeRangeChanged = QtCore.pyqtSignal(float, float)
   updateTimeScroll = QtCore.pyqtSignal(bool)
   annotationAdded = QtCore.pyqtSignal(float, float, str, list)
   annotationModified = QtCore.pyqtSignal(str, str, list)
@@ -310,7 +635,12 @@ class ChartPlot(ChartWidget):
         QtOpenGL.QGLFormat(QtOpenGL.QGL.SampleBuffers),
         parent)
     else:
-      QtWidgets.QWidget.__init__(self, parent)
+      ChartWidget.__init__(self, parent)
+    if ChartWidget == QtWidgets.QOpenGLWidget:
+      surface = QtGui.QSurfaceFormat()
+      surface.setSamples(4)
+      self.setFormat(surface)
+    self._gltraces = None   # Set when OpenGL is initialised
     self.setPalette(QtGui.QPalette(QtGui.QColor('black'), QtGui.QColor('white')))
     self.setMouseTracking(True)
     self._id = None
@@ -325,30 +655,34 @@ class ChartPlot(ChartWidget):
     self._selectmove = None
     self._mousebutton = None
     self._annotations = collections.OrderedDict()  # id --> to tuple(start, end, text, tags, editable)
-    self._annrects = []    # List of tuple(rect, id)
+    self._annlayout = AnnotationLayout()
+    self._layers = {}      # layer --> QPixmap
     self.semantic_tags = { }
 
   def setId(self, id):
   #-------------------
     self._id = str(id)
+    self._invalidate(LAYER_TRACES)
 
   def setSemanticTags(self, tag_dict):
   #-----------------------------------
     self.semantic_tags = tag_dict    ## { uri: label }
+    self._annlayout.reset()          # Colours depend on tag labels
+    self._invalidate(LAYER_ANNOTATIONS)
 
   def addSignalPlot(self, id, label, units, visible=True, data=None, ymin=None, ymax=None):
   #----------------------------------------------------------------------------------------
     plot = SignalPlot(label, units, data, ymin, ymax)
     self._plots[str(id)] = len(self._plotlist)
     self._plotlist.append([str(id), visible, plot])
-    self.update()
+    self._invalidate(LAYER_TRACES)
 
   def addEventPlot(self, id, label, mapping=lambda x: str(x), visible=True, data=None):
   #------------------------------------------------------------------------------------
     plot = EventPlot(label, mapping, data)
     self._plots[str(id)] = len(self._plotlist)
     self._plotlist.append([str(id), visible, plot])
-    self.update()
+    self._invalidate(LAYER_TRACES)
 
   @QtCore.pyqtSlot(str, DataSegment)
   def appendData(self, id, data):
@@ -356,14 +690,67 @@ class ChartPlot(ChartWidget):
     n = self._plots.get(str(id), -1)
     if n >= 0:
       self._plotlist[n][2].appendData(data)
-      self.update()
+      self._invalidate(LAYER_TRACES)
+
+  def appendSegments(self, id, segments):
+  #--------------------------------------
+    """
+    Append a batch of DataSegments to a plot, merging them in at once
+    and redrawing once. An empty segment resets the plot.
+    """
+    n = self._plots.get(str(id), -1)
+    if n >= 0:
+      plot = self._plotlist[n][2]
+      batch = [ ]
+      for d in segments:
+        if len(d):
+          batch.append(d)
+        else:
+          plot.reset()
+          batch = [ ]
+      plot.spliceData(batch)
+      self._invalidate(LAYER_TRACES)
+
+  @QtCore.pyqtSlot(str, float, float)
+  def trimData(self, id, start, end):
+  #----------------------------------
+    n = self._plots.get(str(id), -1)
+    if n >= 0:
+      self._plotlist[n][2].trim(start, end)
+      self._invalidate(LAYER_TRACES)
+
+  def replaceData(self, id, start, end, segments):
+  #-----------------------------------------------
+    """
+    Replace a plot's data from `start` up to `end` with a list of DataSegments.
+    """
+    n = self._plots.get(str(id), -1)
+    if n >= 0:
+      self._plotlist[n][2].spliceData(segments, start, end)
+      self._invalidate(LAYER_TRACES)
+
+  def timeRange(self):
+  #--------------------
+    """ The visible time range, as a (start, end) tuple. """
+    return (self._start, self._end)
+
+  def displayRate(self, duration=None):
+  #------------------------------------
+    """
+    The sampling rate giving about two samples per pixel column when
+    showing the visible time range, or the visible part of a window of
+    `duration` seconds at the current time zoom.
+    """
+    width = max(1, self.width() - (MARGIN_LEFT + MARGIN_RIGHT))
+    visible = (self._end - self._start) if duration is None else duration/self._timezoom
+    return 2.0*width/visible
 
   def setPlotVisible(self, id, visible=True):
   #------------------------------------------
     n = self._plots.get(str(id), -1)
     if n >= 0:
       self._plotlist[n][1] = visible
-      self.update()
+      self._invalidate(LAYER_TRACES)
 
   def plotOrder(self):
   #-------------------
@@ -389,7 +776,7 @@ class ChartPlot(ChartWidget):
     for i, n in enumerate(sorted(order)):
       self._plotlist[n] = plots[i]
       self._plots[plots[i][0]] = n
-    self.update()
+    self._invalidate(LAYER_TRACES)
 
   def movePlot(self, from_id, to_id):
   #----------------------------------
@@ -406,108 +793,167 @@ class ChartPlot(ChartWidget):
         for i in xrange(n, m): self._plots[self._plotlist[i][0]] = i
       self._plotlist[m] = p
       self._plots[str(from_id)] = m
-    self.update()
+    self._invalidate(LAYER_TRACES)
 
   def plotSelected(self, row):
   #---------------------------
     for n, p in enumerate(self._plotlist):
       p[2].selected = (n == row)
-    self.update()
+    self._invalidate(LAYER_TRACES)
 
   def resetAnnotations(self):
   #--------------------------
     self._annotations = collections.OrderedDict()
-    self._annrects = []
+    self._annlayout.reset()
+    self._invalidate(LAYER_ANNOTATIONS)
 
   def addAnnotation(self, id, start, end, text, tags, edit=False):
   #---------------------------------------------------------------
     if end is None: end = start
     if end > self.start and start < self.end:
       self._annotations[str(id)] = (start, end, text, tags, edit)
+      self._annlayout.reset()
+      self._invalidate(LAYER_ANNOTATIONS)
 
   def deleteAnnotation(self, id):
   #------------------------------
     self._annotations.pop(str(id), None)
-    self.update()
+    self._annlayout.reset()
+    self._invalidate(LAYER_ANNOTATIONS)
 
   def resizeEvent(self, e):
   #-----------------------
+    ChartWidget.resizeEvent(self, e)
+    self._invalidate()
     self.chartPosition.emit(self.pos().x() + MARGIN_LEFT,
                             self.width() - (MARGIN_LEFT + MARGIN_RIGHT),
                             self.pos().y() + self.height())
-  
+
+  def _invalidate(self, *layers):
+  #------------------------------
+    """
+    Discard cached layers (all of them if none are given) so that
+    they are redrawn when next painted.
+    """
+    if layers:
+      for layer in layers: self._layers.pop(layer, None)
+    else:
+      self._layers = {}
+    self.update()
+
+  def initializeGL(self):
+  #----------------------
+    if ChartWidget != QtWidgets.QOpenGLWidget: return
+    gltraces = GLTraces()
+    if gltraces.initialise(self.context()):
+      self._gltraces = gltraces
+      self.context().aboutToBeDestroyed.connect(self._release_gl)
+    else:
+      self._gltraces = None
+    self._invalidate()
+
+  def _release_gl(self):
+  #---------------------
+    if self._gltraces is not None:
+      self.makeCurrent()
+      self._gltraces.release()
+      self.doneCurrent()
+      self._gltraces = None
+
+  def paintGL(self):
+  #-----------------
+    self._paint()
+
   def paintEvent(self, e):
   #-----------------------
-    self._draw(self)
+    if ChartWidget == QtWidgets.QOpenGLWidget:
+      ChartWidget.paintEvent(self, e)      # Calls paintGL()
+    else:
+      self._paint()
+
+  def _paint(self):
+  #----------------
+    gltraces = self._gltraces is not None and self._gltraces.available
+    qp = self._begin(self, self.width(), self.height())
+    if ChartWidget == QtWidgets.QOpenGLWidget: self._clear(qp, gltraces)
+    self._draw_selection(qp)
+    self._draw_layer(qp, LAYER_ANNOTATIONS, self._draw_annotations)
+    self._draw_layer(qp, LAYER_TRACES, lambda painter: self._draw_traces(painter, not gltraces))
+    if gltraces: self._draw_gl_traces(qp)
+    self._draw_overlay(qp)
+    qp.end()
+
+  def _clear(self, painter, gltraces):
+  #-----------------------------------
+    """
+    Clear the whole framebuffer to the palette's background colour, as
+    it's kept between paints and layers are drawn over it with alpha.
+    """
+    colour = self.palette().color(self.backgroundRole())
+    if gltraces:
+      self._gltraces.clear(painter, colour)
+    else:
+      painter.save()
+      painter.resetTransform()
+      painter.setClipping(False)
+      painter.setCompositionMode(QtGui.QPainter.CompositionMode_Source)
+      painter.fillRect(self.rect(), colour)
+      painter.restore()
+
+  def _draw_layer(self, painter, layer, draw):
+  #-------------------------------------------
+    pixmap = self._layers.get(layer)
+    if pixmap is None:
+      ratio = self.devicePixelRatioF()
+      pixmap = QtGui.QPixmap(self.size()*ratio)
+      pixmap.setDevicePixelRatio(ratio)
+      pixmap.fill(QtCore.Qt.transparent)
+      qp = self._begin(pixmap, self.width(), self.height())
+      draw(qp)
+      qp.end()
+      self._layers[layer] = pixmap
+    painter.save()
+    painter.resetTransform()
+    painter.drawPixmap(0, 0, pixmap)
+    painter.restore()
 
   def _draw(self, device):
   #-----------------------
+    qp = self._begin(device, device.width(), device.height())
+    self._draw_selection(qp)
+    self._draw_annotations(qp)
+    self._draw_traces(qp)
+    self._draw_overlay(qp)
+    qp.end()                     # Done all drawing
+
+  def _begin(self, device, w, h):
+  #------------------------------
+    """
+    Start painting, with the plotting region set as (0, 0) to (1, 1)
+    and origin at bottom left.
+    """
     qp = QtGui.QPainter()
     qp.begin(device)
-
     qp.setRenderHint(QtGui.QPainter.Antialiasing)
-
-    w = device.width()
-    h = device.height()
     self._plot_width  = w - (MARGIN_LEFT + MARGIN_RIGHT)
     self._plot_height = h - (MARGIN_TOP + MARGIN_BOTTOM)
-
-    if self._id is not None:
-      drawtext(qp, MARGIN_LEFT+self._plot_width/2, 10, self._id,
-               fontSize=16, fontWeight=QtGui.QFont.Bold)
-
-    # Set pixel positions of markers and selected region for
-    # use in mouse events.
-    for m in self._markers: m[0] = self._time_to_pos(m[1])
-    if self._selectstart is not None:
-      self._selectend[0] = self._time_to_pos(self._selectend[1])
-      self._selectstart[0] = self._time_to_pos(self._selectstart[1])
-
-    # Set plotting region as (0, 0) to (1, 1) with origin at bottom left
     qp.translate(MARGIN_LEFT, MARGIN_TOP + self._plot_height)
     qp.scale(self._plot_width, -self._plot_height)
     qp.setClipRect(0, 0, 1, 1)
     qp.setClipping(False)
-    qp.setPen(QtGui.QPen(gridMajorColour, 0))
-    qp.drawRect(0, 0, 1, 1)
-
-    labelxfm = qp.transform()       # before time transforms
-
-    # Now transform to time co-ordinates
-    qp.scale(1.0/(self._end - self._start), 1.0)
-    qp.translate(-self._start, 0.0)
-    self._showSelectionRegion(qp)   # Highlight selected region
-    self._showAnnotations(qp)       # Show annotations
-    self._showSelectionTimes(qp)    # Time labels on top of annotation bars
-    self._showTimeMarkers(qp)       # Position markers
-    self._draw_time_grid(qp)
+    return qp
 
-    # Draw each each visible trace
-    plots = [ p[2] for p in self._plotlist if p[1] ]
-    gridheight = 0
-    for plot in plots: gridheight += plot.gridheight
-    plotposition = gridheight
-    try:
-      labelfreq = int(10.0/(float(self._plot_height)/(gridheight + 1))) + 1
-    except ZeroDivisionError:
-      labelfreq = 0
-    for plot in plots:
-      qp.save()
-      qp.scale(1.0, float(plot.gridheight)/gridheight)
-      plotposition -= plot.gridheight
-      qp.translate(0.0, float(plotposition)/plot.gridheight)
-      plot.drawTrace(qp, self._start, self._end,
-        labelfreq=labelfreq,
-        markers=[m[1] for m in self._markers])
-      qp.restore()
-    # Event labels have now been assigned (by drawTrace())
-    # so can show them
-    qp.setTransform(labelxfm)
-    self._draw_plot_labels(qp)
-    qp.end()                     # Done all drawing
+  def _scale_time(self, painter):
+  #------------------------------
+    painter.scale(1.0/(self._end - self._start), 1.0)
+    painter.translate(-self._start, 0.0)
 
-  def _draw_plot_labels(self, painter):
-  #-----------------------------------
+  def _visible_plots(self, painter):
+  #---------------------------------
+    """
+    Generate the visible plots, with the painter scaled so that
+    (0.0, 1.0) is the vertical extent of the plot being yielded.
+    """
     plots = [ p[2] for p in self._plotlist if p[1] ]
     gridheight = 0
     for plot in plots: gridheight += plot.gridheight
@@ -517,14 +963,103 @@ class ChartPlot(ChartWidget):
       painter.scale(1.0, float(plot.gridheight)/gridheight)
       plotposition -= plot.gridheight
       painter.translate(0.0, float(plotposition)/plot.gridheight)
+      yield plot
+      painter.restore()
+
+  def _draw_selection(self, painter):
+  #----------------------------------
+    painter.save()
+    self._scale_time(painter)
+    self._showSelectionRegion(painter)   # Highlight selected region
+    painter.restore()
+
+  def _draw_annotations(self, painter):
+  #------------------------------------
+    painter.save()
+    self._scale_time(painter)
+    self._showAnnotations(painter)
+    painter.restore()
+
+  def _draw_traces(self, painter, traces=True):
+  #--------------------------------------------
+    """
+    Draw the chart's title, grid, traces and labels. These only change
+    with the time range, the data, or which plots are shown, and so are
+    cached for drawing underneath markers and the selected region.
+
+    Signal traces are left out if `traces` is False, for when they are
+    drawn using OpenGL.
+    """
+    if self._id is not None:
+      drawtext(painter, MARGIN_LEFT+self._plot_width/2, 10, self._id,
+               mapX=False, mapY=False, fontSize=16, fontWeight=QtGui.QFont.Bold)
+    painter.save()
+    painter.setPen(QtGui.QPen(gridMajorColour, 0))
+    painter.drawRect(0, 0, 1, 1)
+    labelxfm = painter.transform()       # before time transforms
+    self._scale_time(painter)
+    self._draw_time_grid(painter)
+    gridheight = 0
+    for p in self._plotlist:
+      if p[1]: gridheight += p[2].gridheight
+    try:
+      labelfreq = int(10.0/(float(self._plot_height)/(gridheight + 1))) + 1
+    except ZeroDivisionError:
+      labelfreq = 0
+    for plot in self._visible_plots(painter):
+      plot.drawTrace(painter, self._start, self._end, labelfreq=labelfreq, trace=traces)
+    painter.setTransform(labelxfm)
+    for plot in self._visible_plots(painter):
       painter.setPen(QtGui.QPen(textColour, 0))
       drawtext(painter, (MARGIN_LEFT-40)/2, 0.5, plot.label, mapX=False)  # Signal label
+    painter.restore()
+
+  def _draw_gl_traces(self, painter):
+  #----------------------------------
+    painter.save()
+    self._scale_time(painter)
+    traces = []
+    for plot in self._visible_plots(painter):
+      if isinstance(plot, SignalPlot):
+        plot._scaleY(painter)
+        traces.append((plot, painter.transform(),
+                       QtGui.QColor(traceColour if not plot.selected else selectedColour)))
+    painter.restore()
+    self._gltraces.draw(painter, traces, self._start, self._end, self.size(),
+                        QtCore.QRectF(MARGIN_LEFT, MARGIN_TOP, self._plot_width, self._plot_height),
+                        self.devicePixelRatioF())
+
+  def _draw_overlay(self, painter):
+  #--------------------------------
+    """
+    Draw markers, the times of the selected region, and the values
+    and event descriptions at each marker. These change as the mouse
+    is dragged and so are drawn afresh every time.
+    """
+    # Set pixel positions of markers and selected region for
+    # use in mouse events.
+    for m in self._markers: m[0] = self._time_to_pos(m[1])
+    if self._selectstart is not None:
+      self._selectend[0] = self._time_to_pos(self._selectend[1])
+      self._selectstart[0] = self._time_to_pos(self._selectstart[1])
+    painter.save()
+    labelxfm = painter.transform()
+    self._scale_time(painter)
+    self._showSelectionTimes(painter)    # Time labels on top of annotation bars
+    self._showTimeMarkers(painter)       # Position markers
+    markers = [m[1] for m in self._markers]
+    for plot in self._visible_plots(painter):
+      plot.drawMarkers(painter, markers)
+    # Event labels have been assigned (by drawTrace())
+    # so can show them
+    painter.setTransform(labelxfm)
+    for plot in self._visible_plots(painter):
       for n, m in enumerate(self._markers):
         ytext = plot.yPosition(m[0])
         if ytext is not None:                             # Write event descriptions on RHS
           painter.setPen(QtGui.QPen(markerColour if n == 0 else marker2Colour, 0))
           drawtext(painter, MARGIN_LEFT+self._plot_width+25, 0.50, ytext, mapX=False)
-      painter.restore()
+    painter.restore()
 
   def _showSelectionRegion(self, painter):
   #---------------------------------------
@@ -581,6 +1116,7 @@ class ChartPlot(ChartWidget):
     self._timeRange = NumericRange(start, end)
     self._start = start
     self._end = end
+    self._invalidate()
 
   def _showTimeMarkers(self, painter):
   #-----------------------------------
@@ -604,53 +1140,21 @@ class ChartPlot(ChartWidget):
 
   def _showAnnotations(self, painter):
   #-----------------------------------
+    self._annlayout.update(self._annotations, self._annotation_display_text)
     xfm = painter.transform()
     painter.resetTransform()
     right_side = MARGIN_LEFT + self._plot_width
     line_space = ANN_LINE_WIDTH + ANN_LINE_GAP
-    # Sort (into time order), start from top, and not
-    # step down if prev. end <= new start
-    # Save bar rectangle for finding tool tip...
-    self._annrects = []      # list if (rect, id) pairs
-    endtimes = []            # [endtime, colour] pair for each row
-    nextcolour = 0
-    colourdict = {}          # key by text, to use the same colour for the same text
-    for ann, id in sorted([ (ann, id)
-                            for id, ann in self._annotations.items() ]):
-      row = None
-      colours = [ None, None, None ]   # On left, above, below
-      for n, e in enumerate(endtimes):
-        if ann[0] > e[0]:     # Start time after last end on this row?
-          row = n
-          e[0] = ann[1]       # Save end time
-          colours[0] = e[1]
-          if (n + 1) < len(endtimes):
-            colours[2] = endtimes[n+1][1]
-          break
-        colours[1] = e[1]
-      if row is None:
-        row = len(endtimes)
-        endtimes.append([ann[1], None])
+    for (start, end, row, colourindex, id) in self._annlayout.bars:
+      if start > self._end: break          # Bars are in time order
       ann_top = ANN_START + row*line_space
-      text = self._annotation_display_text(ann)
-      thiscolour = colourdict.get(text, None)
-      if thiscolour is None:
-        used = -1
-        l = len(ANN_COLOURS)
-        used = [ c for c in colours if c is not None ]
-        thiscolour = nextcolour
-        while thiscolour in used:      # Must terminate since len(ANN_COLOURS) > len(used)
-          thiscolour = (thiscolour + 1) % len(ANN_COLOURS)
-        nextcolour = (nextcolour + 1) % len(ANN_COLOURS)
-        colourdict[text] = thiscolour
-      endtimes[row][1] = thiscolour  # Save colour index
-      colour = ANN_COLOURS[thiscolour]
+      colour = ANN_COLOURS[colourindex]
       pen = QtGui.QPen(colour, 0)
 #      pen.setCapStyle(QtCore.Qt.FlatCap)
 #      pen.setWidth(1)
       painter.setPen(pen)
-      xstart = self._time_to_pos(ann[0])
-      xend = self._time_to_pos(ann[1])
+      xstart = self._time_to_pos(start)
+      xend = self._time_to_pos(end)
       if MARGIN_LEFT < xstart < right_side:
         painter.drawLine(QtCore.QPoint(xstart, ann_top),
                          QtCore.QPoint(xstart, MARGIN_TOP+self._plot_height))
@@ -669,9 +1173,24 @@ class ChartPlot(ChartWidget):
 #        pen.setWidth(ANN_LINE_WIDTH)
 #        painter.setPen(pen)
         painter.fillRect(rect, colour)
-        self._annrects.append((rect, id))
     painter.setTransform(xfm)
 
+  def _annotationAt(self, xpos, ypos):
+  #-----------------------------------
+    """
+    Find the annotation whose bar is at a pixel position.
+
+    :return: The annotation's id, or None.
+    """
+    line_space = ANN_LINE_WIDTH + ANN_LINE_GAP
+    if (ypos < ANN_START or (ypos - ANN_START) % line_space >= ANN_LINE_WIDTH
+     or not (MARGIN_LEFT - 2) <= xpos <= (MARGIN_LEFT + self._plot_width + 2)): return None
+    self._annlayout.update(self._annotations, self._annotation_display_text)
+    scale = float(self._duration)/self._plot_width
+    return self._annlayout.find((ypos - ANN_START)//line_space,
+                                self._start + (xpos - MARGIN_LEFT)*scale,
+                                2*scale)           # Instants are drawn 4 pixels wide
+
   def _pos_to_time(self, pos):
   #---------------------------  
     time = self._start + float(self._duration)*(pos - MARGIN_LEFT)/self._plot_width
@@ -707,6 +1226,7 @@ class ChartPlot(ChartWidget):
     self._setTimeGrid(newstart, newend)
     #for m in self._markers: m[0] = self._time_to_pos(m[1])
     self.update()
+    self.timeRangeChanged.emit(newstart, newend)
 
   def setTimeScroll(self, scrollbar):
   #----------------------------------
@@ -725,11 +1245,13 @@ class ChartPlot(ChartWidget):
 #      if m[1] < self._start: m[1] = self._start
 #      if m[1] > self._end: m[1] = self._end
     self.update()
+    self.timeRangeChanged.emit(self._start, self._end)
 
   def setMarker(self, time):
   #-------------------------
     self._markers[0][0] = self._time_to_pos(time)
     self._markers[0][1] = self._timeRange.map(time)
+    self.update()
 
   def mousePressEvent(self, event):
   #--------------------------------
@@ -801,15 +1323,14 @@ class ChartPlot(ChartWidget):
     xtime = self._pos_to_time(xpos)
     tooltip = False
     if self._mousebutton is None:
-      for a in self._annrects:
-        if a[0].contains(xpos, ypos):
-          font = QtWidgets.QToolTip.font()
-          font.setPointSize(16)
-          QtWidgets.QToolTip.setFont(font)
-          QtWidgets.QToolTip.showText(event.globalPos(),
-            self._annotation_display_text(self._annotations[a[1]]))
-          tooltip = True
-          break
+      ann_id = self._annotationAt(xpos, ypos)
+      if ann_id is not None:
+        font = QtWidgets.QToolTip.font()
+        font.setPointSize(16)
+        QtWidgets.QToolTip.setFont(font)
+        QtWidgets.QToolTip.showText(event.globalPos(),
+          self._annotation_display_text(self._annotations[ann_id]))
+        tooltip = True
     elif self._marker >= 0:
       self._markers[self._marker][0] = xpos
       self._markers[self._marker][1] = xtime
@@ -843,31 +1364,30 @@ class ChartPlot(ChartWidget):
   def contextMenu(self, pos):
   #--------------------------
     self._mousebutton = None
-    for a in self._annrects:
-      if a[0].contains(pos):
-        ann_id = a[1]
-        ann = self._annotations[ann_id]
-        if ann[4]:  # editable
-          menu = QtWidgets.QMenu()
-          menu.addAction("Edit")
-          menu.addAction("Delete")
-          item = menu.exec_(self.mapToGlobal(pos))
-          if item:
-            if item.text() == 'Edit':
-              dialog = AnnotationDialog(self._id, ann[0], ann[1], text=ann[2], tags=ann[3], parent=self)
-              if dialog.exec_():
-                text = str(dialog.get_annotation()).strip()
-                tags = dialog.get_tags()
-                if (text and text != str(ann[2]).strip() or tags != ann[3]):
-                  self.annotationModified.emit(ann_id, text, tags)
-            elif item.text() == 'Delete':
-              confirm = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Question, "Delete Annotation",
-                "Delete Annotation", QtWidgets.QMessageBox.Cancel | QtWidgets.QMessageBox.Ok)
-              confirm.setInformativeText("Do you want to delete the annotation?")
-              confirm.setDefaultButton(QtWidgets.QMessageBox.Cancel)
-              if confirm.exec_() == QtWidgets.QMessageBox.Ok:
-                self.annotationDeleted.emit(ann_id)
-        return
+    ann_id = self._annotationAt(pos.x(), pos.y())
+    if ann_id is not None:
+      ann = self._annotations[ann_id]
+      if ann[4]:  # editable
+        menu = QtWidgets.QMenu()
+        menu.addAction("Edit")
+        menu.addAction("Delete")
+        item = menu.exec_(self.mapToGlobal(pos))
+        if item:
+          if item.text() == 'Edit':
+            dialog = AnnotationDialog(self._id, ann[0], ann[1], text=ann[2], tags=ann[3], parent=self)
+            if dialog.exec_():
+              text = str(dialog.get_annotation()).strip()
+              tags = dialog.get_tags()
+              if (text and text != str(ann[2]).strip() or tags != ann[3]):
+                self.annotationModified.emit(ann_id, text, tags)
+          elif item.text() == 'Delete':
+            confirm = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Question, "Delete Annotation",
+              "Delete Annotation", QtWidgets.QMessageBox.Cancel | QtWidgets.QMessageBox.Ok)
+            confirm.setInformativeText("Do you want to delete the annotation?")
+            confirm.setDefaultButton(QtWidgets.QMessageBox.Cancel)
+            if confirm.exec_() == QtWidgets.QMessageBox.Ok:
+              self.annotationDeleted.emit(ann_id)
+      return
     if (MARGIN_TOP < pos.y() <= (MARGIN_TOP + self._plot_height)
      and MARGIN_LEFT < pos.x() <= (MARGIN_LEFT + self._plot_width)):
       menu = QtWidgets.QMenu()
@@ -905,10 +1425,22 @@ class ChartPlot(ChartWidget):
         item = menu.exec_(self.mapToGlobal(pos))
         if item:
           filename = QtWidgets.QFileDialog.getSaveFileName(self, 'Save chart', '', '*.png')
-          if filename:
-            output = QtGui.QImage(self.width(), self.height(), QtGui.QImage.Format_ARGB32_Premultiplied)
-            self._draw(output)
-            output.save(filename, 'PNG')
+          if filename: self.save_as_png(filename)
+
+  def image(self, width, height):
+  #------------------------------
+    """
+    Draw the chart into a new QImage, which needn't be the size of the
+    widget. The widget doesn't need to be shown.
+    """
+    output = QtGui.QImage(width, height, QtGui.QImage.Format_ARGB32_Premultiplied)
+    output.fill(QtCore.Qt.white)
+    self._draw(output)
+    return output
+
+  def save_as_png(self, filename):
+  #-------------------------------
+    self.image(self.width(), self.height()).save(filename, 'PNG')
 
 
 if __name__ == '__main__':
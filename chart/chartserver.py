@@ -0,0 +1,253 @@
+"""
+A headless HTTP service returning charts of recordings as PNG images.
+
+Charts are drawn by a pool of worker processes, each using Qt's
+`offscreen` platform and a plain, non-OpenGL, chart widget, so no
+display or OpenGL context is needed. Rendered images are
+cached, keyed by the recording's graph (i.e. version) so that a chart
+is drawn again when a recording's annotations or data change, and expire
+after a time. Requests are of the form::
+
+  GET /chart?uri=RECORDING&start=0&duration=10&signals=ID,ID&width=1200&height=800
+
+where ``signals`` is an optional, comma separated, list of signal URIs
+or of their ids relative to the recording. Start and duration are in
+seconds.
+
+Usage::
+
+  python chartserver.py [--host HOST] [--port PORT] [--workers N] [--cache MB]
+"""
+
+import os
+import time
+import logging
+import argparse
+import threading
+import collections
+import multiprocessing
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+  from urlparse import urlparse, parse_qs
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+  from urllib.parse import urlparse, parse_qs
+
+
+DEFAULT_PORT     = 8090
+DEFAULT_WORKERS  = 4
+DEFAULT_CACHE    = 64          # MB
+DEFAULT_DURATION = 10.0        # seconds
+DEFAULT_WIDTH    = 1200
+DEFAULT_HEIGHT   = 800
+
+IMAGE_TTL        = 300.0       # Seconds a rendered image is served for
+GRAPH_TTL        = 10.0        # Seconds before checking a recording's graph again
+
+
+_app = None                    # The QApplication of a worker process
+
+def _start_worker():
+#===================
+  global _app
+  os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+  os.environ['CHART_NO_OPENGL'] = '1'     # Chosen when chartplot is imported
+  from PyQt5 import QtWidgets
+  _app = QtWidgets.QApplication([])
+
+
+def _current_recording(uri):
+#===========================
+  from repositories import repository
+  store = repository(uri)
+  recording = store.refresh('get_recording', uri)
+  if recording is None: raise IOError("Unknown recording: %s" % uri)
+  return (store, recording)
+
+
+def render_png(uri, graph, start, duration, signals, width, height):
+#===================================================================
+  """
+  Draw a chart of part of a recording, in a worker process.
+
+  :param graph: The recording's graph, as got by :meth:`ChartServer._graph`.
+  :return: The chart as PNG data.
+  """
+  from PyQt5 import QtCore
+  from chartplot import ChartPlot
+  from runchart import add_signal_plot, signal_uri
+
+  (store, recording) = _current_recording(uri)
+  chart = ChartPlot()
+  chart.setId(str(recording.uri))
+  chart.setSemanticTags(store.get_semantic_tags())
+  chart.setTimeRange(start, duration)
+  interval = recording.interval(start, duration)
+  for s in recording.signals():
+    id = signal_uri(s)
+    if signals and id not in signals and str(s.uri) not in signals: continue
+    add_signal_plot(chart, s)
+    for d in s.read(interval, maxpoints=20000):
+      chart.appendData(id, d)
+  for a in store.get_annotations(uri, recording.graph):
+    if a.time is not None:
+      end = None if a.time.duration in [None, 0.0] else a.time.end
+      chart.addAnnotation(str(a.uri), a.time.start, end,
+                          a.comment if a.comment is not None else '', a.tags)
+  data = QtCore.QByteArray()
+  output = QtCore.QBuffer(data)
+  output.open(QtCore.QIODevice.WriteOnly)
+  chart.image(width, height).save(output, 'PNG')
+  output.close()
+  return bytes(data)
+
+
+class ImageCache(object):
+#========================
+  """
+  A thread safe, least recently used, cache of rendered images, each
+  served for at most `ttl` seconds.
+
+  :param size: The maximum total size, in bytes, of cached images.
+  """
+
+  def __init__(self, size, ttl=IMAGE_TTL):
+  #---------------------------------------
+    self._size = size
+    self._ttl = ttl
+    self._used = 0
+    self._images = collections.OrderedDict()   # key --> (expires, image)
+    self._lock = threading.Lock()
+
+  def get(self, key):
+  #------------------
+    with self._lock:
+      entry = self._images.pop(key, None)
+      if entry is None: return None
+      if entry[0] <= time.time():
+        self._used -= len(entry[1])
+        return None
+      self._images[key] = entry
+      return entry[1]
+
+  def put(self, key, image):
+  #-------------------------
+    if len(image) > self._size: return
+    with self._lock:
+      previous = self._images.pop(key, None)
+      if previous is not None: self._used -= len(previous[1])
+      while self._images and (self._used + len(image)) > self._size:
+        self._used -= len(self._images.popitem(last=False)[1][1])
+      self._images[key] = (time.time() + self._ttl, image)
+      self._used += len(image)
+
+
+class ChartRequestHandler(BaseHTTPRequestHandler):
+#=================================================
+
+  def do_GET(self):
+  #----------------
+    url = urlparse(self.path)
+    if url.path != '/chart':
+      self.send_error(404)
+      return
+    params = parse_qs(url.query)
+    try:
+      uri = params['uri'][0]
+      start = float(params.get('start', [0.0])[0])
+      duration = float(params.get('duration', [DEFAULT_DURATION])[0])
+      signals = tuple(sorted(params['signals'][0].split(','))) if 'signals' in params else ()
+      width = int(params.get('width', [DEFAULT_WIDTH])[0])
+      height = int(params.get('height', [DEFAULT_HEIGHT])[0])
+      if duration <= 0.0 or width <= 0 or height <= 0: raise ValueError("Invalid chart size")
+    except (KeyError, ValueError) as msg:
+      self.send_error(400, "Invalid request: %s" % msg)
+      return
+    try:
+      png = self.server.render(uri, start, duration, signals, width, height)
+    except Exception as msg:
+      logging.error("Cannot render %s: %s", self.path, msg)
+      self.send_error(500, str(msg))
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', 'image/png')
+    self.send_header('Content-Length', str(len(png)))
+    self.end_headers()
+    self.wfile.write(png)
+
+
+class ChartServer(ThreadingMixIn, HTTPServer):
+#=============================================
+  """
+  Serve PNG charts, rendered by a pool of worker processes.
+
+  :param address: A (host, port) tuple to listen on.
+  :param workers: The number of rendering processes.
+  :param cachesize: The maximum size, in bytes, of the image cache.
+  """
+
+  daemon_threads = True
+
+  def __init__(self, address, workers=DEFAULT_WORKERS, cachesize=DEFAULT_CACHE*1024*1024):
+  #---------------------------------------------------------------------------------------
+    HTTPServer.__init__(self, address, ChartRequestHandler)
+    self._pool = multiprocessing.Pool(workers, initializer=_start_worker)
+    self._cache = ImageCache(cachesize)
+    self._graphs = { }        # recording uri --> (checked, graph)
+    self._lock = threading.Lock()
+
+  def _graph(self, uri):
+  #---------------------
+    """
+    The recording's current graph, checked at most every `GRAPH_TTL`
+    seconds by querying the repository for just the graph's URI.
+    """
+    from repositories import repository
+    with self._lock:
+      graph = self._graphs.get(uri)
+    if graph is None or graph[0] + GRAPH_TTL <= time.time():
+      (current, recording) = repository(uri).get_graph_and_recording_uri(uri)
+      if current is None: raise IOError("Unknown recording: %s" % uri)
+      graph = (time.time(), str(current))
+      with self._lock:
+        self._graphs[uri] = graph
+    return graph[1]
+
+  def render(self, uri, start, duration, signals, width, height):
+  #--------------------------------------------------------------
+    key = (uri, self._graph(uri), start, duration, signals, width, height)
+    png = self._cache.get(key)
+    if png is None:
+      png = self._pool.apply(render_png, key)
+      self._cache.put(key, png)
+    return png
+
+  def server_close(self):
+  #----------------------
+    HTTPServer.server_close(self)
+    self._pool.terminate()
+
+
+if __name__ == '__main__':
+#=========================
+
+  logging.basicConfig(format='%(asctime)s %(levelname)8s %(processName)s: %(message)s')
+  logging.getLogger().setLevel('INFO')
+
+  parser = argparse.ArgumentParser(description="Serve charts of recordings as PNG images")
+  parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+  parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Port to listen on")
+  parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of rendering processes")
+  parser.add_argument('--cache', type=int, default=DEFAULT_CACHE, help="Size of image cache, in MB")
+  args = parser.parse_args()
+
+  server = ChartServer((args.host, args.port), args.workers, args.cache*1024*1024)
+  logging.info("Serving charts on http://%s:%d/chart", args.host, args.port)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  server.server_close()
@@ -0,0 +1,259 @@
+"""
+Min/max decimation of sampled data.
+
+A :class:`MinMaxPyramid` keeps successively coarser min/max envelopes
+of a trace so that it can be drawn with around two vertices per pixel
+column, no matter how many samples have been loaded.
+"""
+
+import numpy as np
+
+
+DECIMATION = 8        # Bins (or samples) of a level that make up a bin of the next
+
+SAMPLE_DTYPES = (np.float64, np.float32)   # Of (time, value) columns
+
+
+class ColumnBuffer(object):
+#==========================
+  """
+  Growable, column oriented storage for numeric data.
+
+  Capacity is doubled when full so appending is amortised O(1). Columns
+  are returned as views into the buffer, not as copies.
+
+  :param dtypes: A sequence giving the numpy dtype of each column.
+  """
+
+  def __init__(self, dtypes, capacity=1024):
+  #-----------------------------------------
+    self._columns = [ np.empty(capacity, dtype=dt) for dt in dtypes ]
+    self._size = 0
+
+  def __len__(self):
+  #-----------------
+    return self._size
+
+  @property
+  def nbytes(self):
+  #----------------
+    """ The memory allocated to the buffer, in bytes. """
+    return sum(c.nbytes for c in self._columns)
+
+  def column(self, n):
+  #-------------------
+    return self._columns[n][:self._size]
+
+  def clear(self):
+  #---------------
+    self._size = 0
+
+  def truncate(self, size):
+  #------------------------
+    if size < self._size: self._size = size
+
+  def append(self, *columns):
+  #--------------------------
+    size = self._size + len(columns[0])
+    capacity = len(self._columns[0])
+    if size > capacity:
+      while capacity < size: capacity *= 2
+      for n, c in enumerate(self._columns):
+        grown = np.empty(capacity, dtype=c.dtype)
+        grown[:self._size] = c[:self._size]
+        self._columns[n] = grown
+    for c, data in zip(self._columns, columns):
+      c[self._size:size] = data
+    self._size = size
+
+
+def minmax_vertices(times, values, size):
+#========================================
+  """
+  Reduce a polyline to two vertices per bin of `size` vertices.
+
+  Each bin contributes the vertices holding its minimum and maximum
+  values, in time order. The last bin may be partially filled.
+  """
+  count = len(values)
+  full = count//size
+  bins = full + (1 if count > full*size else 0)
+  index = np.empty(2*bins, dtype=np.intp)
+  if full:
+    v = values[:full*size].reshape(full, size)
+    imin = v.argmin(axis=1)
+    imax = v.argmax(axis=1)
+    base = np.arange(full)*size
+    index[0:2*full:2] = base + np.minimum(imin, imax)
+    index[1:2*full:2] = base + np.maximum(imin, imax)
+  if bins > full:
+    base = full*size
+    imin = int(values[base:].argmin())
+    imax = int(values[base:].argmax())
+    index[-2] = base + min(imin, imax)
+    index[-1] = base + max(imin, imax)
+  return (times[index], values[index])
+
+
+def spliced(times, values, newtimes, newvalues, start=None, end=None):
+#=====================================================================
+  """
+  Replace samples from `start` up to `end` with new, time ordered,
+  samples. Without `start`, new samples are merged in from the time of
+  the first of them.
+
+  :return: A tuple of (times, values) arrays, only sorted if the new
+    samples overlap those kept, or None if the new samples are simply
+    to be appended.
+  """
+  if start is None:
+    if len(newtimes) == 0: return None
+    start = end = newtimes[0]
+  first = np.searchsorted(times, start, side='left')
+  if first == len(times) and (first == 0 or len(newtimes) == 0 or newtimes[0] >= times[-1]):
+    return None
+  last = max(first, np.searchsorted(times, end, side='left'))
+  t = np.concatenate((times[:first], newtimes, times[last:]))
+  v = np.concatenate((values[:first], newvalues, values[last:]))
+  if len(newtimes) and ((first > 0 and newtimes[0] < times[first-1])
+                     or (last < len(times) and newtimes[-1] > times[last])):
+    order = np.argsort(t, kind='mergesort')
+    (t, v) = (t[order], v[order])
+  return (t, v)
+
+
+class MinMaxPyramid(object):
+#===========================
+  """
+  A multi-level min/max envelope of a trace.
+
+  Level 0 holds the samples themselves, and is the only copy of them
+  kept for a trace. A bin at level ``k+1`` covers
+  ``factor`` bins (or, at level 0, samples) of level ``k`` and is drawn
+  as two vertices, at its minimum and maximum. Levels are extended as
+  data is appended with only the last (possibly partial) bin of each
+  level being recalculated.
+  """
+
+  def __init__(self, factor=DECIMATION):
+  #-------------------------------------
+    self._factor = factor
+    self._levels = [ ColumnBuffer(SAMPLE_DTYPES) ]
+    self.generation = 0     # Changed whenever existing vertices are replaced
+
+  def __len__(self):
+  #-----------------
+    return len(self._levels[0])
+
+  @property
+  def nbytes(self):
+  #----------------
+    return sum(level.nbytes for level in self._levels)
+
+  @property
+  def times(self):
+  #---------------
+    return self._levels[0].column(0)
+
+  @property
+  def values(self):
+  #----------------
+    return self._levels[0].column(1)
+
+  def level(self, n):
+  #------------------
+    return self._levels[n]
+
+  def clear(self):
+  #---------------
+    del self._levels[1:]
+    self._levels[0].clear()
+    self.generation += 1
+
+  def append(self, times, values):
+  #-------------------------------
+    if len(times) == 0: return
+    self._levels[0].append(times, values)
+    level = 0
+    while True:
+      source = self._levels[level]
+      size = self._factor if level == 0 else 2*self._factor
+      if len(source) <= size: break
+      if len(self._levels) == level + 1:
+        self._levels.append(ColumnBuffer(SAMPLE_DTYPES))
+      target = self._levels[level + 1]
+      done = max(0, len(target)//2 - 1)  # Last bin may have been partial
+      target.truncate(2*done)
+      target.append(*minmax_vertices(source.column(0)[done*size:],
+                                     source.column(1)[done*size:], size))
+      level += 1
+
+  def trim(self, start, end):
+  #--------------------------
+    """
+    Remove samples from before `start` and from `end` onwards.
+    """
+    times = self.times
+    first = np.searchsorted(times, start, side='left')
+    last = np.searchsorted(times, end, side='left')
+    if first == 0 and last == len(times): return
+    kept = (times[first:last].copy(), self.values[first:last].copy())
+    self.clear()
+    self.append(*kept)
+
+  def cut(self, start, end):
+  #-------------------------
+    """
+    Remove samples from `start` up to `end`.
+    """
+    times = self.times
+    first = np.searchsorted(times, start, side='left')
+    last = np.searchsorted(times, end, side='left')
+    if first == last: return
+    kept = (np.concatenate((times[:first], times[last:])),
+            np.concatenate((self.values[:first], self.values[last:])))
+    self.clear()
+    self.append(*kept)
+
+  def splice(self, times, values, start=None, end=None):
+  #-----------------------------------------------------
+    """
+    Insert time ordered samples, as :func:`spliced` does. Samples after
+    all of those held are appended, otherwise levels are rebuilt once.
+    """
+    kept = spliced(self.times, self.values, times, values, start, end)
+    if kept is None:
+      self.append(times, values)
+    else:
+      self.clear()
+      self.append(*kept)
+
+  def visible(self, start, end, limit):
+  #------------------------------------
+    """
+    Find the finest level having at most `limit` vertices between
+    `start` and `end`, or the coarsest level if none do.
+
+    One vertex either side of the interval is included so that a
+    polyline drawn from them reaches the interval's edges.
+
+    :return: A tuple of (level, first, last) giving the level's number
+      and the slice of its vertices that are visible.
+    """
+    for n, level in enumerate(self._levels):
+      times = level.column(0)
+      first = np.searchsorted(times, start, side='left')
+      last = np.searchsorted(times, end, side='right')
+      if (last - first) <= limit: break
+    return (n, max(0, first - 1), min(len(times), last + 1))
+
+  def vertices(self, start, end, limit):
+  #-------------------------------------
+    """
+    Get the visible vertices of the level found by :meth:`visible`.
+
+    :return: A tuple of (times, values) arrays, as views into the level.
+    """
+    (n, first, last) = self.visible(start, end, limit)
+    level = self._levels[n]
+    return (level.column(0)[first:last], level.column(1)[first:last])
@@ -0,0 +1,213 @@
+"""
+Blocks of signal data kept on disk between sessions.
+
+Each block is saved as a ``.npy`` file of (time, value) rows and is
+opened memory-mapped, so that reading a block only touches the pages
+that are used. An index, kept as JSON alongside the blocks, records
+each block's recording and size in least recently used order, and the
+graph (i.e. version) of each recording whose blocks are cached. Blocks
+of a recording are removed when it is opened with a different graph.
+
+The index is saved when the cache is flushed, and at most every
+`INDEX_INTERVAL` seconds as blocks are added, rather than for every
+block. Blocks and the index are written to uniquely named temporary
+files that then replace the originals, so concurrent writers can't
+corrupt each other's files.
+"""
+
+import os
+import time
+import json
+import errno
+import tempfile
+import hashlib
+import logging
+import threading
+import collections
+
+import numpy as np
+
+
+DISK_CACHE_SIZE = 2*1024*1024*1024   # Bytes
+
+INDEX_FILE      = 'index.json'
+
+INDEX_INTERVAL  = 30.0               # Seconds between saves of the index
+
+
+def _replace(source, destination):
+#=================================
+  try:
+    os.replace(source, destination)
+  except AttributeError:             # Python 2
+    if os.path.exists(destination): os.remove(destination)   # For Windows
+    os.rename(source, destination)
+
+
+def _temporary(path):
+#====================
+  """
+  Open a uniquely named temporary file in a directory.
+
+  :return: A tuple of the open file and its name.
+  """
+  (fd, name) = tempfile.mkstemp(suffix='.tmp', dir=path)
+  return (os.fdopen(fd, 'wb'), name)
+
+
+class DiskCache(object):
+#=======================
+  """
+  A thread safe, least recently used, cache of blocks on disk.
+
+  :param path: The directory holding cached blocks.
+  :param size: The maximum total size, in bytes, of cached blocks.
+  """
+
+  def __init__(self, path, size=DISK_CACHE_SIZE):
+  #----------------------------------------------
+    self._path = path
+    self._size = size
+    self._lock = threading.Lock()
+    self._blocks = collections.OrderedDict()   # file name --> [recording uri, bytes]
+    self._recordings = { }                     # recording uri --> graph uri
+    self._used = 0
+    self._changed = False                      # Index needs saving
+    self._saved = time.time()
+    self._saving = threading.Lock()            # Held while the index is written
+    try:
+      os.makedirs(path)
+    except OSError as e:
+      if e.errno != errno.EEXIST: raise
+    try:
+      with open(os.path.join(path, INDEX_FILE)) as f:
+        index = json.load(f, object_pairs_hook=collections.OrderedDict)
+      self._recordings = dict(index['recordings'])
+      for name, block in index['blocks'].items():
+        if os.path.exists(os.path.join(path, name)):
+          self._blocks[name] = block
+          self._used += block[1]
+    except (IOError, ValueError, KeyError) as msg:
+      if os.path.exists(os.path.join(path, INDEX_FILE)):
+        logging.warning("Ignoring invalid block cache index: %s", msg)
+
+  @property
+  def used(self):
+  #--------------
+    return self._used
+
+  def open_recording(self, uri, graph):
+  #------------------------------------
+    """
+    Note the graph a recording is being read from, removing the
+    recording's blocks if they were read from a different graph.
+    """
+    uri = str(uri)
+    graph = str(graph)
+    with self._lock:
+      previous = self._recordings.get(uri)
+      if previous == graph: return
+      if previous is not None:
+        for name in [ n for n, b in self._blocks.items() if b[0] == uri ]:
+          self._remove(name)
+      self._recordings[uri] = graph
+      self._changed = True
+    self._save()
+
+  @staticmethod
+  def _name(recording, key):
+  #-------------------------
+    return hashlib.sha1(repr((str(recording), key)).encode('utf-8')).hexdigest() + '.npy'
+
+  def __contains__(self, item):
+  #----------------------------
+    (recording, key) = item
+    return self._name(recording, key) in self._blocks
+
+  def get(self, recording, key):
+  #-----------------------------
+    """
+    Get a block as a memory-mapped array of (time, value) rows, or None
+    if the block isn't cached.
+    """
+    name = self._name(recording, key)
+    with self._lock:
+      block = self._blocks.pop(name, None)
+      if block is None: return None
+      self._blocks[name] = block
+      self._changed = True
+    try:
+      return np.load(os.path.join(self._path, name), mmap_mode='r')
+    except (IOError, ValueError) as msg:
+      logging.warning("Cannot read cached block: %s", msg)
+      with self._lock:
+        self._remove(name)
+      return None
+
+  def put(self, recording, key, points):
+  #-------------------------------------
+    """
+    Cache a block, given as an array of (time, value) rows.
+    """
+    name = self._name(recording, key)
+    if points.nbytes > self._size: return
+    filename = os.path.join(self._path, name)
+    temporary = None
+    try:
+      (f, temporary) = _temporary(self._path)
+      with f: np.save(f, points)
+      _replace(temporary, filename)
+    except (IOError, OSError) as msg:
+      logging.warning("Cannot cache block: %s", msg)
+      if temporary is not None and os.path.exists(temporary): os.remove(temporary)
+      return
+    size = os.path.getsize(filename)
+    with self._lock:
+      previous = self._blocks.pop(name, None)
+      if previous is not None: self._used -= previous[1]
+      self._blocks[name] = [ str(recording), size ]
+      self._used += size
+      while self._used > self._size and len(self._blocks) > 1:
+        self._remove(next(iter(self._blocks)))
+      self._changed = True
+    if time.time() - self._saved >= INDEX_INTERVAL: self._save()
+
+  def flush(self):
+  #---------------
+    """
+    Save the index, if changed, so that blocks' use is remembered.
+    """
+    self._save()
+
+  def _remove(self, name):
+  #-----------------------
+    block = self._blocks.pop(name, None)
+    if block is not None: self._used -= block[1]
+    try:
+      os.remove(os.path.join(self._path, name))
+    except OSError:
+      pass
+
+  def _save(self):
+  #---------------
+    """
+    Save the index if it has changed, writing a copy taken under the lock
+    so that other threads aren't held up while it's written.
+    """
+    with self._saving:
+      with self._lock:
+        if not self._changed: return
+        index = { 'recordings': dict(self._recordings),
+                  'blocks': collections.OrderedDict(self._blocks) }
+        self._changed = False
+        self._saved = time.time()
+      temporary = None
+      try:
+        (f, temporary) = _temporary(self._path)
+        with f: f.write(json.dumps(index).encode('utf-8'))
+        _replace(temporary, os.path.join(self._path, INDEX_FILE))
+      except (IOError, OSError) as msg:
+        logging.warning("Cannot save block cache index: %s", msg)
+        if temporary is not None and os.path.exists(temporary): os.remove(temporary)
+        with self._lock:
+          self._changed = True
@@ -0,0 +1,137 @@
+"""
+Load a recording's events in bulk, as lightweight rows.
+
+Rather than getting each event from the repository in turn, the time,
+duration and type of all matching events are selected by a SPARQL query
+that is read a page at a time. Stores that can't be queried in this way
+(e.g. a :class:`~localstore.LocalStore`) have their events got one by
+one, as before.
+"""
+
+import re
+import logging
+import collections
+
+
+EVENT_PAGE = 10000        # Events selected by each query
+
+PREFIXES = { 'bsml': 'http://www.biosignalml.org/ontologies/2011/04/biosignalml#',
+             'tl':   'http://purl.org/NET/c4dm/timeline.owl#' }
+
+_ISODURATION = re.compile(r'^(-)?P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?)?$')
+
+
+def seconds(value):
+#==================
+  """
+  Seconds given by an xsd:duration literal, such as ``PT1.5S``, or by a
+  plain number. None is returned for None.
+  """
+  if value is None: return None
+  match = _ISODURATION.match(value.strip())
+  if match is None: return float(value)
+  (sign, days, hours, minutes, secs) = match.groups()
+  result = (86400.0*int(days or 0) + 3600.0*int(hours or 0)
+            + 60.0*int(minutes or 0) + float(secs or 0.0))
+  return -result if sign else result
+
+
+class EventRow(collections.namedtuple('EventRow', 'uri eventtype start duration')):
+#=================================================================================
+  """
+  An event's URI, type, start time and duration, the last None for an
+  instantaneous event.
+  """
+  __slots__ = ()
+
+  @property
+  def end(self):
+  #-------------
+    return self.start + self.duration if self.duration else self.start
+
+
+def _query(recording, eventtype, timetype, graph_uri):
+#====================================================
+  where = [ '?event a bsml:Event ; bsml:recording <%s> ; bsml:eventType ?etype ; bsml:time ?tm .' % recording ]
+  if eventtype is not None: where.append('FILTER (?etype = <%s>)' % eventtype)
+  if timetype is not None: where.append('?tm a <%s> .' % timetype)
+  where.append('{ ?tm a bsml:Instant ; tl:at ?start }'
+               ' UNION { ?tm a bsml:Interval ; tl:start ?start . OPTIONAL { ?tm tl:duration ?duration } }')
+  where = ' '.join(where)
+  if graph_uri is not None: where = 'GRAPH <%s> { %s }' % (graph_uri, where)
+  return where.replace('%', '%%')     # The store substitutes parameters into the pattern
+
+
+def _value(binding, name):
+#=========================
+  value = binding.get(name)
+  if isinstance(value, dict): value = value.get('value')
+  return None if value is None else str(value)
+
+
+def _select(store, recording, eventtype, timetype, graph_uri, page):
+#===================================================================
+  where = _query(recording, eventtype, timetype, graph_uri)
+  offset = 0
+  while True:
+    bindings = store.select('?event ?etype ?start ?duration', where, prefixes=PREFIXES,
+                            order='?event', limit='%d OFFSET %d' % (page, offset))
+    yield [ EventRow(_value(b, 'event'), _value(b, 'etype'),
+                     seconds(_value(b, 'start')), seconds(_value(b, 'duration')))
+              for b in bindings ]
+    if len(bindings) < page: return
+    offset += page
+
+
+def _one_by_one(store, recording, eventtype, timetype, graph_uri, page):
+#=======================================================================
+  if eventtype is None:
+    uris = store.get_event_uris(recording, timetype=timetype, graph_uri=graph_uri)
+  else:
+    uris = store.events(recording, eventtype=eventtype, timetype=timetype, graph_uri=graph_uri)
+  rows = [ ]
+  for uri in uris:
+    e = store.get_event(uri, graph_uri)
+    rows.append(EventRow(str(e.uri), e.eventtype, e.time.start, e.time.duration))
+    if len(rows) == page:
+      yield rows
+      rows = [ ]
+  if rows: yield rows
+
+
+def event_pages(store, recording, eventtype=None, timetype=None, graph_uri=None, page=EVENT_PAGE):
+#================================================================================================
+  """
+  Get the events of a recording, optionally of a given type and with
+  a given type of time (``BSML.Instant`` or ``BSML.Interval``), a page
+  at a time.
+
+  :param store: The repository holding the recording.
+  :param page: The number of events selected by each query.
+  :return: A generator of lists of :class:`EventRow`.
+  """
+  if hasattr(store, 'select'):
+    pages = _select(store, str(recording), eventtype, timetype, graph_uri, page)
+    try:
+      first = next(pages)
+    except Exception as msg:
+      logging.warning("Cannot select events, getting them one by one: %s", msg)
+    else:
+      yield first
+      for rows in pages: yield rows
+      return
+  for rows in _one_by_one(store, recording, eventtype, timetype, graph_uri, page): yield rows
+
+
+def event_rows(store, recording, eventtype=None, timetype=None, graph_uri=None, page=EVENT_PAGE):
+#===============================================================================================
+  """
+  Get all of a recording's events, as for :func:`event_pages`, ordered
+  by start time.
+
+  :return: A list of :class:`EventRow`.
+  """
+  rows = [ e for rows in event_pages(store, recording, eventtype, timetype, graph_uri, page)
+               for e in rows ]
+  rows.sort(key=lambda e: (e.start, e.uri))
+  return rows
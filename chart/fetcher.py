@@ -0,0 +1,214 @@
+"""
+Read the data of all of a recording's signals for a window together.
+
+Rather than each signal being read by its own worker, a few lanes work
+through the blocks of all signals, taking a block from each signal in
+turn so that every channel fills in at the same rate. A signal is only
+worked on by one lane at a time, so its blocks are sent in time order.
+
+Nothing here depends on Qt. Lanes are run by calling
+:meth:`WindowFetch.run_lane` from worker threads, and results are sent
+to a sink object, so a fetch can be driven by plain threads and stand-in
+signals that read from a local server.
+"""
+
+import math
+import logging
+import threading
+
+from biosignalml.data import DataSegment
+
+from blockcache import block_duration, block_starts
+
+
+FETCH_LANES = 3           # Lanes reading a window's signals
+
+_rate_unsupported = False # Set if reads can't be resampled
+
+
+def resolution(rate, needed):
+#============================
+  """
+  The rate at which to read a signal sampled at `rate` so as to have at
+  least `needed` samples a second. This is the signal's rate halved as
+  many times as possible, so that reads for similar views share blocks.
+
+  Irregularly sampled signals, with `rate` None, are always read in full.
+  """
+  if not rate or not needed or needed >= rate or _rate_unsupported: return rate
+  return rate/2.0**int(math.floor(math.log(rate/float(needed), 2)))
+
+
+def read_segments(signal, interval, rate):
+#=========================================
+  """
+  Read a signal's data for an interval, resampled to `rate` if that
+  isn't the signal's own rate and the repository supports resampling.
+  """
+  global _rate_unsupported
+  if rate != getattr(signal, 'rate', None):
+    try:
+      return signal.read(interval, maxpoints=20000, rate=rate)
+    except TypeError:
+      logging.warning("Signals can't be read at lower rates, reading at full rate")
+      _rate_unsupported = True
+  return signal.read(interval, maxpoints=20000)
+
+
+class FetchToken(object):
+#========================
+  """
+  Identifies the requests for data made by a controller for a window.
+  Cancelled requests stop reading at the next segment and anything they
+  have already sent is dropped when its generation is no longer current.
+  """
+
+  def __init__(self, generation):
+  #------------------------------
+    self.generation = generation
+    self.cancelled = False
+
+  def cancel(self):
+  #----------------
+    self.cancelled = True
+
+
+class _SignalBlocks(object):
+#===========================
+
+  def __init__(self, id, signal, rate, duration, blocks, trim, cached=True):
+  #-------------------------------------------------------------------------
+    self.id = id
+    self.signal = signal
+    self.rate = rate          # Being read at
+    self.duration = duration  # Of each block
+    self.blocks = blocks      # Block starts still to be sent
+    self.trim = trim          # (start, end) to trim the plot to, or None to reset it
+    self.cached = cached      # Blocks are aligned and kept in the cache
+    self.started = False
+    self.busy = False
+
+
+class WindowFetch(FetchToken):
+#=============================
+  """
+  Read the blocks of a set of signals covering an interval, serving
+  blocks from the cache when they are in it and caching those read.
+  Signals are read at the lowest rate giving `needed` samples a second.
+
+  If the plot of a signal already holds all the signal's data for a
+  previous interval, at the same rate, the plot is trimmed to the blocks
+  covering `interval` and only blocks not covering the previous interval
+  are sent, otherwise the plot is reset and all blocks are sent.
+
+  When `replace` is set, each block read replaces the data the plot has
+  for the block's time span, to refine part of a window. Completion of
+  a signal isn't reported if `complete` is False.
+
+  When `final` is given, the fetch is an overview pass of a progressive
+  read whose last pass needs `final` samples a second. Signals that the
+  last pass will read at a higher rate are read for just `interval`, as
+  a single uncached block, rather than in aligned blocks that may
+  extend well beyond the window.
+
+  :param signals: A list of (id, signal, previous) tuples, with
+    `previous` an (interval, needed) tuple of the data already
+    loaded, or None.
+  :param sink: Given the data, with ``appendData(generation, id, data)``,
+    ``trimData(generation, id, start, end)``,
+    ``replaceData(generation, id, start, end, segments)`` and
+    ``completed(generation, id)`` calls, made from the lanes' threads.
+  """
+
+  def __init__(self, generation, signals, interval, cache, sink, needed=None,
+                                           replace=False, complete=True, final=None):
+  #---------------------------------------------------------------------------------
+    FetchToken.__init__(self, generation)
+    self._cache = cache
+    self._sink = sink
+    self._replace = replace
+    self._complete = complete
+    self._lock = threading.Lock()
+    self._next = 0
+    self._signals = [ ]
+    for (id, signal, previous) in signals:
+      rate = resolution(getattr(signal, 'rate', None), needed)
+      if final is not None and resolution(getattr(signal, 'rate', None), final) != rate:
+        self._signals.append(_SignalBlocks(id, signal, rate, interval.end - interval.start,
+                                           [ interval.start ], None, cached=False))
+        continue
+      duration = block_duration(rate, interval.end - interval.start)
+      blocks = list(block_starts(interval.start, interval.end, duration))
+      trim = None
+      if (previous is not None and blocks
+       and resolution(getattr(signal, 'rate', None), previous[1]) == rate
+       and block_duration(rate, previous[0].end - previous[0].start) == duration):
+        loaded = set(block_starts(previous[0].start, previous[0].end, duration))
+        trim = (blocks[0], blocks[-1] + duration)
+        blocks = [ b for b in blocks if b not in loaded ]
+      self._signals.append(_SignalBlocks(id, signal, rate, duration, blocks, trim))
+
+  def _claim(self):
+  #----------------
+    """
+    Take the next signal, in turn, that has work and isn't being read.
+    """
+    with self._lock:
+      count = len(self._signals)
+      for n in range(count):
+        s = self._signals[(self._next + n) % count]
+        if not s.busy and (not s.started or s.blocks):
+          s.busy = True
+          self._next = (self._next + n + 1) % count
+          return s
+
+  def _release(self, s):
+  #---------------------
+    with self._lock:
+      s.busy = False
+
+  def run_lane(self):
+  #------------------
+    """
+    Send blocks, one at a time from each signal in turn, until there are
+    no signals left with blocks that aren't being read by another lane.
+    """
+    while not self.cancelled:
+      s = self._claim()
+      if s is None: return
+      try:
+        self._step(s)
+      except Exception as msg:
+        logging.error(msg)
+        s.blocks = [ ]            # Plot isn't complete, so don't signal completion
+      finally:
+        self._release(s)
+
+  def _step(self, s):
+  #------------------
+    if not s.started:
+      s.started = True
+      if not self._replace:
+        if s.trim is not None: self._sink.trimData(self.generation, s.id, *s.trim)
+        else:                  self._sink.appendData(self.generation, s.id, DataSegment(0, None))
+    if s.blocks:
+      if not self._send_block(s, s.blocks[0]): return
+      del s.blocks[0]
+    if not s.blocks and self._complete: self._sink.completed(self.generation, s.id)
+
+  def _send_block(self, s, start):
+  #-------------------------------
+    key = (str(s.signal.uri), start, s.rate, s.duration)
+    segments = self._cache.get(key) if s.cached else None
+    if segments is None:
+      segments = [ ]
+      for d in read_segments(s.signal, s.signal.recording.interval(start, s.duration), s.rate):
+        if not self._replace: self._sink.appendData(self.generation, s.id, d)
+        segments.append(d)
+        if self.cancelled: return False     # Don't cache a partial block
+      if s.cached: self._cache.put(key, segments)
+    elif not self._replace:
+      for d in segments: self._sink.appendData(self.generation, s.id, d)
+    if self._replace:
+      self._sink.replaceData(self.generation, s.id, start, start + s.duration, segments)
+    return True
@@ -0,0 +1,251 @@
+"""
+Draw traces with OpenGL, from vertex buffer objects.
+
+The vertices of each level of a trace's :class:`~decimate.MinMaxPyramid`
+are uploaded once, in fixed size chunks, with new data being appended
+to the last chunk. Panning and zooming only change the transform given
+to the vertex shader.
+
+Times are held relative to the first vertex of a chunk so that single
+precision vertices keep their resolution in long recordings.
+"""
+
+import logging
+
+import numpy as np
+
+from PyQt5 import QtGui
+
+
+GL_LINE_STRIP       = 0x0003
+GL_FLOAT            = 0x1406
+GL_SCISSOR_TEST     = 0x0C11
+GL_RENDERER         = 0x1F01
+GL_COLOR_BUFFER_BIT = 0x4000
+
+CHUNK_SIZE          = 65536         # Vertices in a vertex buffer, plus one shared with the next
+
+
+VERTEX_SHADER = """
+attribute highp vec2 vertex;
+uniform highp mat4 matrix;
+void main(void)
+{
+  gl_Position = matrix*vec4(vertex, 0.0, 1.0);
+}
+"""
+
+FRAGMENT_SHADER = """
+uniform lowp vec4 colour;
+void main(void)
+{
+  gl_FragColor = colour;
+}
+"""
+
+
+def ndc_matrix(xfm, origin, width, height):
+#==========================================
+  """
+  Combine a painter's transform, from (time, value) to pixels, with the
+  mapping of pixels to OpenGL's normalised device co-ordinates, for
+  vertices whose times are relative to `origin`.
+  """
+  sx = 2.0/width
+  sy = -2.0/height
+  return QtGui.QMatrix4x4(sx*xfm.m11(), sx*xfm.m21(), 0.0, sx*(xfm.dx() + xfm.m11()*origin) - 1.0,
+                          sy*xfm.m12(), sy*xfm.m22(), 0.0, sy*(xfm.dy() + xfm.m12()*origin) + 1.0,
+                          0.0,          0.0,          1.0, 0.0,
+                          0.0,          0.0,          0.0, 1.0)
+
+
+class VertexChunks(object):
+#==========================
+  """
+  The vertices of a pyramid level, in vertex buffers of ``CHUNK_SIZE``
+  vertices. Each buffer also holds the first vertex of the next so
+  that line strips drawn from consecutive buffers join up.
+  """
+
+  def __init__(self):
+  #------------------
+    self._chunks = []       # [buffer, origin] pairs
+    self._size = 0          # Vertices uploaded
+    self._generation = None
+
+  def release(self):
+  #-----------------
+    for chunk in self._chunks: chunk[0].destroy()
+    self._chunks = []
+    self._size = 0
+
+  def sync(self, level, generation):
+  #---------------------------------
+    """
+    Upload vertices added to a level since it was last synchronised.
+    """
+    if generation != self._generation:
+      self.release()
+      self._generation = generation
+    times = level.column(0)
+    values = level.column(1)
+    size = len(times)
+    first = max(0, min(self._size, size) - 2)   # A level's last bin may have changed
+    while len(self._chunks)*CHUNK_SIZE < size:
+      buffer = QtGui.QOpenGLBuffer(QtGui.QOpenGLBuffer.VertexBuffer)
+      buffer.create()
+      buffer.setUsagePattern(QtGui.QOpenGLBuffer.DynamicDraw)
+      buffer.bind()
+      buffer.allocate(8*(CHUNK_SIZE + 1))
+      buffer.release()
+      self._chunks.append([buffer, times[len(self._chunks)*CHUNK_SIZE]])
+    for k in range(first//CHUNK_SIZE, len(self._chunks)):
+      base = k*CHUNK_SIZE
+      lo = max(first, base)
+      hi = min(size, base + CHUNK_SIZE + 1)
+      if lo >= hi: continue
+      (buffer, origin) = self._chunks[k]
+      vertices = np.empty((hi - lo, 2), dtype=np.float32)
+      vertices[:, 0] = times[lo:hi] - origin
+      vertices[:, 1] = values[lo:hi]
+      buffer.bind()
+      buffer.write(8*(lo - base), vertices, vertices.nbytes)
+      buffer.release()
+    self._size = size
+
+  def draw(self, gl, program, attribute, uniform, first, last, matrix):
+  #--------------------------------------------------------------------
+    """
+    Draw vertices `first` up to `last` as a line strip.
+
+    :param matrix: A function giving the transform to use for vertices
+      relative to a chunk's origin.
+    """
+    for k in range(first//CHUNK_SIZE, (last - 1)//CHUNK_SIZE + 1):
+      base = k*CHUNK_SIZE
+      lo = max(first, base)
+      hi = min(last, base + CHUNK_SIZE + 1)
+      if (hi - lo) < 2: continue
+      (buffer, origin) = self._chunks[k]
+      program.setUniformValue(uniform, matrix(origin))
+      buffer.bind()
+      program.setAttributeBuffer(attribute, GL_FLOAT, 0, 2)
+      gl.glDrawArrays(GL_LINE_STRIP, lo - base, hi - lo)
+      buffer.release()
+
+
+class GLTraces(object):
+#======================
+  """
+  Draw :class:`~chartplot.SignalPlot` traces from vertex buffers.
+
+  :meth:`initialise` must be called with the widget's OpenGL context
+  current. If it fails traces must be drawn using QPainter instead.
+  """
+
+  def __init__(self):
+  #------------------
+    self._gl = None
+    self._program = None
+    self._vao = None
+    self._traces = {}       # plot --> (envelope, list of VertexChunks, one per level)
+
+  @property
+  def available(self):
+  #-------------------
+    return self._program is not None
+
+  @property
+  def renderer(self):
+  #------------------
+    """ The OpenGL renderer's name, e.g. `llvmpipe`. The context must be current. """
+    return self._gl.glGetString(GL_RENDERER) if self._gl is not None else None
+
+  def initialise(self, context):
+  #-----------------------------
+    profile = QtGui.QOpenGLVersionProfile()
+    profile.setVersion(2, 0)
+    self._gl = context.versionFunctions(profile)
+    if self._gl is None:
+      logging.warning("OpenGL 2.0 isn't available, traces will be drawn using QPainter")
+      return False
+    self._gl.initializeOpenGLFunctions()
+    program = QtGui.QOpenGLShaderProgram()
+    if not (program.addShaderFromSourceCode(QtGui.QOpenGLShader.Vertex, VERTEX_SHADER)
+        and program.addShaderFromSourceCode(QtGui.QOpenGLShader.Fragment, FRAGMENT_SHADER)
+        and program.link()):
+      logging.warning("Cannot compile trace shaders, traces will be drawn using QPainter: %s",
+                      program.log())
+      return False
+    self._program = program
+    self._vertex = program.attributeLocation('vertex')
+    self._matrix = program.uniformLocation('matrix')
+    self._colour = program.uniformLocation('colour')
+    self._vao = QtGui.QOpenGLVertexArrayObject()
+    self._vao.create()
+    return True
+
+  def clear(self, painter, colour):
+  #--------------------------------
+    """
+    Clear the framebuffer to a colour.
+    """
+    painter.beginNativePainting()
+    self._gl.glClearColor(colour.redF(), colour.greenF(), colour.blueF(), colour.alphaF())
+    self._gl.glClear(GL_COLOR_BUFFER_BIT)
+    painter.endNativePainting()
+
+  def release(self):
+  #-----------------
+    """
+    Free OpenGL resources. The context must be current.
+    """
+    for (envelope, levels) in self._traces.values():
+      for chunks in levels: chunks.release()
+    self._traces = {}
+    if self._vao is not None: self._vao.destroy()
+    self._vao = None
+    self._program = None
+
+  def draw(self, painter, traces, start, end, size, clip, ratio):
+  #--------------------------------------------------------------
+    """
+    Draw traces, clipped to a rectangle.
+
+    :param painter: The active QPainter, on an OpenGL paint device.
+    :param traces: A list of (plot, transform, colour) tuples, with the
+      transform mapping a plot's (time, value) to pixels.
+    :param start: The leftmost time.
+    :param end: The rightmost time.
+    :param size: The device's size, in pixels.
+    :param clip: The rectangle to clip to, in pixels.
+    :param ratio: The device's pixel ratio.
+    """
+    painter.beginNativePainting()
+    gl = self._gl
+    gl.glEnable(GL_SCISSOR_TEST)
+    gl.glScissor(int(clip.x()*ratio), int((size.height() - clip.y() - clip.height())*ratio),
+                 int(clip.width()*ratio), int(clip.height()*ratio))
+    self._program.bind()
+    self._vao.bind()
+    self._program.enableAttributeArray(self._vertex)
+    for (plot, xfm, colour) in traces:
+      envelope = plot.envelope
+      limit = 2*int(abs(xfm.m11())*(end - start) + 0.5)
+      (n, first, last) = envelope.visible(start, end, limit)
+      if (last - first) < 2: continue
+      (previous, levels) = self._traces.get(plot, (None, []))
+      if previous is not envelope:           # Plot has been reset
+        for chunks in levels: chunks.release()
+        levels = []
+        self._traces[plot] = (envelope, levels)
+      while len(levels) <= n: levels.append(VertexChunks())
+      levels[n].sync(envelope.level(n), envelope.generation)
+      self._program.setUniformValue(self._colour, colour)
+      levels[n].draw(gl, self._program, self._vertex, self._matrix, first, last,
+                     lambda origin: ndc_matrix(xfm, origin, size.width(), size.height()))
+    self._program.disableAttributeArray(self._vertex)
+    self._vao.release()
+    self._program.release()
+    gl.glDisable(GL_SCISSOR_TEST)
+    painter.endNativePainting()
@@ -0,0 +1,135 @@
+"""
+Deliver data read by fetch lanes to the GUI thread, a frame at a time.
+
+Lanes add data to a queue without involving Qt. The queue is emptied
+at most once a frame, with each plot's consecutive segments delivered
+as a single batch, so that many signals being read don't flood the
+GUI thread with slot calls and repaints.
+"""
+
+import time
+import threading
+import collections
+
+from PyQt5 import QtCore
+
+
+FRAME_INTERVAL = 16       # Milliseconds between deliveries, about 60 Hz
+
+APPEND  = 0               # Kinds of queued item
+TRIM    = 1
+REPLACE = 2
+DONE    = 3
+
+
+class IngestQueue(QtCore.QObject):
+#=================================
+  """
+  The single bridge carrying data from fetch lanes to the GUI thread.
+
+  It is the sink of a :class:`~fetcher.WindowFetch`. Its signals are
+  emitted on the GUI thread, in order for each plot.
+  """
+
+  append_points = QtCore.pyqtSignal(int, str, object)     # A list of DataSegments
+  trim_points = QtCore.pyqtSignal(int, str, float, float)
+  replace_points = QtCore.pyqtSignal(int, str, float, float, object)
+  read_completed = QtCore.pyqtSignal(int, str)
+
+  _queued = QtCore.pyqtSignal()
+
+  def __init__(self, parent=None):
+  #-------------------------------
+    QtCore.QObject.__init__(self, parent)
+    self._queue = collections.deque()
+    self._lock = threading.Lock()
+    self._waiting = False
+    self._delivered = 0.0
+    self._timer = QtCore.QTimer(self)
+    self._timer.setSingleShot(True)
+    self._timer.timeout.connect(self._deliver)
+    self._queued.connect(self._schedule)     # Queued, from lanes' threads
+    self.reset()
+
+  def reset(self):
+  #---------------
+    """ Zero the counters. """
+    self.max_depth = 0
+    self.batches = 0
+    self.segments = 0
+    self.max_latency = 0.0
+    self._latency = 0.0
+    self._items = 0
+
+  def counters(self):
+  #------------------
+    """
+    :return: A dictionary of the current and maximum queue depth, the
+      number of batches and segments delivered, and the mean and
+      maximum latency, in ms, between queueing and delivering an item.
+    """
+    return { 'depth': len(self._queue), 'max_depth': self.max_depth,
+             'batches': self.batches, 'segments': self.segments,
+             'mean_latency': 1000.0*self._latency/self._items if self._items else 0.0,
+             'max_latency': 1000.0*self.max_latency }
+
+  def _put(self, item):
+  #--------------------
+    with self._lock:
+      self._queue.append((time.time(),) + item)
+      self.max_depth = max(self.max_depth, len(self._queue))
+      if self._waiting: return
+      self._waiting = True
+    self._queued.emit()
+
+  def appendData(self, generation, id, data):
+  #------------------------------------------
+    self._put((APPEND, generation, id, data))
+
+  def trimData(self, generation, id, start, end):
+  #----------------------------------------------
+    self._put((TRIM, generation, id, (start, end)))
+
+  def replaceData(self, generation, id, start, end, segments):
+  #-----------------------------------------------------------
+    self._put((REPLACE, generation, id, (start, end, segments)))
+
+  def completed(self, generation, id):
+  #-----------------------------------
+    self._put((DONE, generation, id, None))
+
+  def _schedule(self):
+  #-------------------
+    if not self._timer.isActive():
+      wait = FRAME_INTERVAL - 1000.0*(time.time() - self._delivered)
+      self._timer.start(max(0, int(wait)))
+
+  def _deliver(self):
+  #------------------
+    with self._lock:
+      items = list(self._queue)
+      self._queue.clear()
+      self._waiting = False
+    self._delivered = now = time.time()
+    plots = collections.OrderedDict()    # (generation, id) --> list of [kind, data]
+    for (queued, kind, generation, id, data) in items:
+      latency = now - queued
+      self._latency += latency
+      self._items += 1
+      if latency > self.max_latency: self.max_latency = latency
+      work = plots.setdefault((generation, id), [])
+      if kind == APPEND:
+        self.segments += 1
+        if work and work[-1][0] == APPEND:
+          work[-1][1].append(data)
+          continue
+        data = [ data ]
+      work.append([kind, data])
+    for (generation, id), work in plots.items():
+      for (kind, data) in work:
+        if kind == APPEND:
+          self.batches += 1
+          self.append_points.emit(generation, id, data)
+        elif kind == TRIM:    self.trim_points.emit(generation, id, *data)
+        elif kind == REPLACE: self.replace_points.emit(generation, id, *data)
+        else:                 self.read_completed.emit(generation, id)
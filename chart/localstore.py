@@ -0,0 +1,308 @@
+"""
+Open BioSignalML HDF5 recordings from local files, without a repository.
+
+:class:`LocalStore` provides the calls :class:`~runchart.Controller`
+makes of a repository. A recording's metadata is read using
+biosignalml's HDF5 format, while signal data is read straight from the
+file's datasets. Contiguous, uncompressed datasets are memory-mapped so
+that reads return views of the file, not copies; others are sliced
+using h5py when read.
+
+Annotations and events are read from the RDF metadata stored in the
+file, when first asked for. Annotations made while viewing are kept in
+memory for the session, as the file is opened read-only.
+"""
+
+import os
+import math
+import bisect
+import logging
+import collections
+
+import numpy as np
+import h5py
+
+import biosignalml.model
+import biosignalml.rdf as rdf
+from biosignalml import BSML
+from biosignalml.rdf import RDF, PRV
+from biosignalml.data import DataSegment, UniformTimeSeries, TimeSeries
+from biosignalml.formats.hdf5 import HDF5Recording
+
+
+SIGNAL_GROUP = '/recording/signal'
+METADATA     = '/metadata'
+
+
+def text(value):
+#===============
+  """ An HDF5 string attribute as a native string. """
+  return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+def mapped(dataset):
+#===================
+  """
+  A memory-mapped view of an HDF5 dataset, or the dataset itself if it's
+  chunked, compressed or otherwise can't be mapped.
+  """
+  offset = dataset.id.get_offset()
+  if offset is None or dataset.chunks is not None: return dataset
+  return np.memmap(dataset.file.filename, mode='r', dtype=dataset.dtype,
+                   shape=dataset.shape, offset=offset)
+
+
+class Column(object):
+#====================
+  """
+  A column of a two dimensional HDF5 dataset, only read when indexed.
+  """
+
+  def __init__(self, dataset, column):
+  #-----------------------------------
+    self._dataset = dataset
+    self._column = column
+
+  def __len__(self):
+  #-----------------
+    return self._dataset.shape[0]
+
+  def __getitem__(self, index):
+  #----------------------------
+    return self._dataset[index, self._column]
+
+
+def column(data, n):
+#===================
+  """
+  A column of a memory-mapped array, as a view, or of a dataset, to be
+  read when sliced.
+  """
+  return data[:, n] if isinstance(data, np.ndarray) else Column(data, n)
+
+
+class LocalSignal(object):
+#=========================
+  """
+  A signal of a :class:`LocalRecording`, read from its dataset.
+
+  Other attributes are those of the signal as read by biosignalml.
+
+  :param data: The signal's values, as an array, dataset or :class:`Column`.
+  :param times: Sample times of an irregularly sampled signal, else None.
+  """
+
+  def __init__(self, signal, recording, data, times=None, gain=1.0, offset=0.0):
+  #-----------------------------------------------------------------------------
+    self._signal = signal
+    self.recording = recording
+    self._data = data
+    self._times = times
+    self._gain = gain
+    self._offset = offset
+
+  def __getattr__(self, name):
+  #---------------------------
+    return getattr(self._signal, name)
+
+  def _scale(self, values):
+  #------------------------
+    if self._gain != 1.0 or self._offset != 0.0: return self._gain*values + self._offset
+    return values
+
+  def read(self, interval=None, maxpoints=None, rate=None, **kwds):
+  #----------------------------------------------------------------
+    """
+    Read the signal's data for an interval, as DataSegments of at most
+    `maxpoints` points. A uniformly sampled signal can be read at a
+    lower `rate`, by taking every n'th sample.
+    """
+    if self._data is None:
+      for d in self._signal.read(interval, maxpoints=maxpoints, **kwds): yield d
+      return
+    size = len(self._data)
+    chunk = maxpoints if maxpoints else size
+    if self._times is None:
+      srate = float(self.rate)
+      step = max(1, int(srate/rate)) if rate else 1
+      if interval is None:
+        (first, last) = (0, size)
+      else:
+        first = max(0, int(math.ceil(interval.start*srate)))
+        last = min(size, int(math.ceil(interval.end*srate)))
+      first = step*int(math.ceil(first/float(step)))   # Same samples whatever the interval
+      for n in range(first, last, chunk*step):
+        values = self._data[n:min(n + chunk*step, last):step]
+        yield DataSegment(n/srate, UniformTimeSeries(self._scale(values), rate=srate/step))
+    else:
+      if interval is None:
+        (first, last) = (0, size)
+      else:
+        first = bisect.bisect_left(self._times, interval.start)   # Only reads the elements probed
+        last = bisect.bisect_left(self._times, interval.end)
+      for n in range(first, last, chunk):
+        end = min(n + chunk, last)
+        yield DataSegment(0.0, TimeSeries(self._scale(self._data[n:end]), self._times[n:end]))
+
+
+class LocalRecording(object):
+#============================
+  """
+  A recording in a local file, with signals read by :class:`LocalSignal`.
+
+  Its graph identifies the file's version, so cached data is
+  invalidated when the file changes.
+  """
+
+  def __init__(self, recording, graph):
+  #------------------------------------
+    self._recording = recording
+    self.graph = graph
+    self._signals = [ ]
+
+  def __getattr__(self, name):
+  #---------------------------
+    return getattr(self._recording, name)
+
+  def signals(self):
+  #-----------------
+    return self._signals
+
+
+class LocalStore(object):
+#========================
+  """
+  A store holding a single recording from a BioSignalML HDF5 file.
+
+  :param path: The file's path.
+  """
+
+  def __init__(self, path):
+  #------------------------
+    self._path = path
+    self._file = h5py.File(path, 'r')
+    recording = HDF5Recording.open(path)
+    graph = 'file://%s#%d' % (os.path.abspath(path), int(os.path.getmtime(path)))
+    self._recording = LocalRecording(recording, graph)
+    datasets = self._datasets()
+    for s in recording.signals():
+      (data, times, gain, offset) = datasets.get(str(s.uri), (None, None, 1.0, 0.0))
+      self._recording.signals().append(LocalSignal(s, self._recording, data, times, gain, offset))
+    self._stored = None       # (annotations, events) in the file's metadata
+    self._resources = { }     # Annotations and segments made this session
+    self._removed = set()     # URIs of annotations removed this session
+
+  def _datasets(self):
+  #-------------------
+    """
+    Find the data, and any clock, of each signal in the file. No data
+    is read, as columns of datasets that can't be mapped are only read
+    when sliced.
+
+    :return: A dictionary mapping a signal's URI to a tuple of (data,
+      times, gain, offset).
+    """
+    datasets = { }
+    def visit(name, item):
+      if not isinstance(item, h5py.Dataset) or 'uri' not in item.attrs: return
+      uris = item.attrs['uri']
+      data = mapped(item)
+      times = None
+      if 'clock' in item.attrs:
+        times = mapped(self._file[item.attrs['clock']])
+        if times.ndim > 1: times = column(times, 0)
+      gain = float(item.attrs.get('gain', 1.0))
+      offset = float(item.attrs.get('offset', 0.0))
+      if np.ndim(uris) == 0:                    # One signal
+        datasets[text(uris)] = (data if data.ndim == 1 else column(data, 0), times, gain, offset)
+      else:                                     # A signal per column
+        for n, uri in enumerate(uris):
+          datasets[text(uri)] = (column(data, n), times, gain, offset)
+    if SIGNAL_GROUP in self._file: self._file[SIGNAL_GROUP].visititems(visit)
+    return datasets
+
+  def _metadata(self):
+  #-------------------
+    """
+    The annotations and events in the file's metadata, read the first
+    time they're needed. Annotations that have been superseded by a
+    later version are skipped.
+
+    :return: A tuple of (annotations, events), each a dictionary keyed
+      by URI.
+    """
+    if self._stored is None:
+      annotations = { }
+      events = { }
+      graph = None
+      if METADATA in self._file:
+        metadata = self._file[METADATA]
+        try:
+          graph = rdf.Graph.create_from_string(self._recording.uri, text(metadata[()]),
+                                               text(metadata.attrs.get('mimetype', rdf.Format.RDFXML)))
+        except Exception as msg:
+          logging.warning("Cannot read metadata of %s: %s", self._path, msg)
+      if graph is not None:
+        for node in graph.get_subjects(RDF.type, BSML.Annotation):
+          if any(True for s in graph.get_subjects(PRV.precededBy, node.uri)): continue
+          annotations[str(node.uri)] = biosignalml.model.Annotation.create_from_graph(node.uri, graph)
+        for node in graph.get_subjects(RDF.type, BSML.Event):
+          events[str(node.uri)] = biosignalml.model.Event.create_from_graph(node.uri, graph)
+      self._stored = (annotations, events)
+    return self._stored
+
+  def _events(self, eventtype=None, timetype=None):
+  #------------------------------------------------
+    return [ e for e in self._metadata()[1].values()
+               if (eventtype is None or str(e.eventtype) == str(eventtype))
+              and (timetype is None or (e.time is not None
+                                    and str(e.time.metaclass) == str(timetype))) ]
+
+  def close(self):
+  #---------------
+    self._file.close()
+
+  def get_recording(self, uri, **kwds):
+  #------------------------------------
+    if str(uri) in [ self._path, str(self._recording.uri) ]: return self._recording
+
+  def get_semantic_tags(self):
+  #---------------------------
+    return { }
+
+  def get_annotations(self, uri, graph_uri=None):
+  #----------------------------------------------
+    """
+    The file's annotations along with those made this session, less those
+    removed or replaced this session.
+    """
+    session = [ r for r in self._resources.values() if isinstance(r, biosignalml.model.Annotation) ]
+    hidden = self._removed.union(str(a.precededBy) for a in session if a.precededBy is not None)
+    return [ a for a in list(self._metadata()[0].values()) + session if str(a.uri) not in hidden ]
+
+  def get_event(self, uri, graph_uri=None):
+  #----------------------------------------
+    event = self._resources.get(str(uri))
+    return event if event is not None else self._metadata()[1].get(str(uri))
+
+  def get_event_uris(self, uri, eventtype=None, timetype=None, graph_uri=None):
+  #----------------------------------------------------------------------------
+    return [ e.uri for e in self._events(eventtype, timetype) ]
+
+  def events(self, uri, eventtype=None, timetype=None, graph_uri=None):
+  #--------------------------------------------------------------------
+    return [ e.uri for e in self._events(eventtype, timetype) ]
+
+  def event_types(self, uri, counts=False, graph_uri=None):
+  #--------------------------------------------------------
+    types = collections.Counter(str(e.eventtype) for e in self._events())
+    return sorted(types.items()) if counts else sorted(types)
+
+  def extend_recording_graph(self, recording, *resources):
+  #-------------------------------------------------------
+    for r in resources: self._resources[str(r.uri)] = r
+
+  def remove_recording_resource(self, recording, uri):
+  #---------------------------------------------------
+    self._resources.pop(str(uri), None)
+    self._removed.add(str(uri))
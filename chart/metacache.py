@@ -0,0 +1,147 @@
+"""
+Cache the metadata a repository returns about recordings.
+
+:class:`CachedRepository` wraps a repository, such as a
+``biosignalml.client.Repository``, and remembers the results of its
+metadata calls for a time. Results are shared by all wrappers of the
+same repository in the process, so a second view of a recording
+doesn't make metadata requests. Writing to a recording's graph drops
+the cached results that mention the recording or its graph.
+"""
+
+import time
+import threading
+
+
+METADATA_TTL = 300.0      # Seconds that cached results are used for
+
+CACHED_CALLS = [ 'get_recording', 'get_semantic_tags', 'get_annotations', 'get_event',
+                 'get_event_uris', 'events', 'event_types' ]
+
+UNCHANGED_BY_WRITES = [ 'get_recording', 'get_semantic_tags' ]
+
+
+class MetadataCache(object):
+#===========================
+  """
+  Results of a repository's metadata calls, each kept for `ttl` seconds.
+  """
+
+  def __init__(self, ttl=METADATA_TTL):
+  #------------------------------------
+    self._ttl = ttl
+    self._entries = { }       # (call, args) --> (expires, result)
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+  #------------------
+    """
+    :return: A tuple of (True, result) if `key` has an unexpired result,
+      else (False, None).
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        if entry[0] > time.time():
+          self.hits += 1
+          return (True, entry[1])
+        del self._entries[key]
+      self.misses += 1
+      return (False, None)
+
+  def put(self, key, result):
+  #--------------------------
+    with self._lock:
+      self._entries[key] = (time.time() + self._ttl, result)
+
+  def invalidate(self, *uris):
+  #---------------------------
+    """
+    Drop results of calls that have any of `uris` as an argument, other
+    than those that writes to a graph don't change.
+    """
+    uris = set(str(u) for u in uris if u is not None)
+    with self._lock:
+      for key in [ k for k in self._entries
+                     if k[0] not in UNCHANGED_BY_WRITES and uris.intersection(k[1]) ]:
+        del self._entries[key]
+
+  def clear(self):
+  #---------------
+    with self._lock:
+      self._entries.clear()
+
+
+_caches = { }
+_caches_lock = threading.Lock()
+
+def metadata_cache(uri, ttl=METADATA_TTL):
+#=========================================
+  """
+  The cache, shared within the process, of a repository's metadata.
+  """
+  with _caches_lock:
+    cache = _caches.get(str(uri))
+    if cache is None:
+      cache = _caches[str(uri)] = MetadataCache(ttl)
+    return cache
+
+
+class CachedRepository(object):
+#==============================
+  """
+  A repository whose metadata calls are cached. Other attributes are
+  those of the wrapped repository.
+
+  :param store: The repository to wrap.
+  """
+
+  def __init__(self, store, ttl=METADATA_TTL):
+  #-------------------------------------------
+    self._store = store
+    self._cache = metadata_cache(store.uri, ttl)
+
+  def __getattr__(self, name):
+  #---------------------------
+    attr = getattr(self._store, name)
+    if name not in CACHED_CALLS: return attr
+    def cached(*args, **kwds):
+      key = self._key(name, args, kwds)
+      (found, result) = self._cache.get(key)
+      if not found:
+        result = attr(*args, **kwds)
+        if result is not None: self._cache.put(key, result)
+      return result
+    return cached
+
+  @staticmethod
+  def _key(name, args, kwds):
+  #--------------------------
+    return (name, tuple(str(a) for a in args) + tuple(str(v) for (k, v) in sorted(kwds.items())),
+            tuple(sorted(kwds)))
+
+  def refresh(self, name, *args, **kwds):
+  #--------------------------------------
+    """
+    Make a cached call of the repository, replacing any cached result.
+    """
+    result = getattr(self._store, name)(*args, **kwds)
+    if result is not None: self._cache.put(self._key(name, args, kwds), result)
+    return result
+
+  def extend_recording_graph(self, recording, *resources):
+  #-------------------------------------------------------
+    try:
+      return self._store.extend_recording_graph(recording, *resources)
+    finally:
+      self._cache.invalidate(recording.uri, getattr(recording, 'graph', None),
+                             *[ r.uri for r in resources ])
+
+  def remove_recording_resource(self, recording, uri):
+  #---------------------------------------------------
+    try:
+      return self._store.remove_recording_resource(recording, uri)
+    finally:
+      self._cache.invalidate(recording.uri, getattr(recording, 'graph', None), uri)
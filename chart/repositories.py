@@ -0,0 +1,283 @@
+"""
+Repository clients shared by all of a process's windows.
+
+Connecting to a repository and getting an access token takes longer
+than reading the metadata of a small recording, so one client is kept
+for each repository base URL and is used by every viewer and browser
+window. Metadata requests reuse a small pool of HTTP sessions, each
+keeping its connection alive, rather than connecting for every request.
+Calls made through a shared client, including the reading of signal
+data, are limited to a few at a time and are counted. Clients are kept
+open for the life of the process, as the recordings and signals they
+have returned keep reading through them.
+"""
+
+import socket
+import inspect
+import logging
+import threading
+try:
+  from urlparse import urlparse
+except ImportError:
+  from urllib.parse import urlparse
+
+import httplib2
+
+from biosignalml import client
+from biosignalml.rdf.sparqlstore import StoreException
+
+from metacache import CachedRepository
+
+
+MAX_REQUESTS = 4          # Concurrent metadata calls made of a repository
+MAX_READS    = 4          # Concurrent signal data reads from a repository
+
+REQUEST_TIMEOUT = 20      # Seconds, as used by biosignalml's SPARQL store
+
+
+def base_url(uri):
+#=================
+  """
+  The base URL, i.e. scheme and host, of a repository holding `uri`.
+  """
+  p = urlparse(str(uri))
+  return '%s://%s' % (p.scheme, p.netloc)
+
+
+class SessionPool(object):
+#=========================
+  """
+  HTTP sessions that keep their connections alive, each used by one
+  request at a time.
+  """
+
+  def __init__(self, timeout=REQUEST_TIMEOUT):
+  #-------------------------------------------
+    self._timeout = timeout
+    self._sessions = [ ]
+    self._lock = threading.Lock()
+    self.created = 0
+
+  def request(self, url, **kwds):
+  #------------------------------
+    with self._lock:
+      if self._sessions:
+        session = self._sessions.pop()
+      else:
+        session = httplib2.Http(timeout=self._timeout)
+        self.created += 1
+    try:
+      result = session.request(url, **kwds)
+    except Exception:
+      self._close(session)
+      raise
+    with self._lock:
+      self._sessions.append(session)
+    return result
+
+  @staticmethod
+  def _close(session):
+  #-------------------
+    for connection in list(session.connections.values()):
+      connection.close()
+    session.connections.clear()
+
+  def close(self):
+  #---------------
+    with self._lock:
+      sessions = self._sessions
+      self._sessions = [ ]
+    for session in sessions: self._close(session)
+
+
+class RepositoryConnection(object):
+#==================================
+  """
+  A repository client whose calls are limited to `limit` at a time,
+  and whose signal data reads are separately limited to `reads` at a
+  time, so that long reads don't hold up metadata calls. Other
+  attributes are those of the client.
+  """
+
+  def __init__(self, repository, limit=MAX_REQUESTS, reads=MAX_READS):
+  #-------------------------------------------------------------------
+    self._repository = repository
+    self._slots = threading.BoundedSemaphore(limit)
+    self._read_slots = threading.BoundedSemaphore(reads)
+    self._lock = threading.Lock()
+    self._sessions = SessionPool()
+    store = getattr(repository, 'store', None)
+    if store is not None and _poolable(store): store._request = self._store_request(store)
+    self.requests = 0
+    self.reads = 0
+    self.in_flight = 0
+
+  def __getattr__(self, name):
+  #---------------------------
+    attr = getattr(self._repository, name)
+    if not callable(attr): return attr
+    if name == 'get_data':
+      def read(*args, **kwds):
+        with self._read_slots:
+          self._started(read=True)
+          try:
+            for segment in attr(*args, **kwds):
+              yield segment
+          finally:
+            self._finished()
+      return read
+    def limited(*args, **kwds):
+      with self._slots:
+        self._started()
+        try:
+          result = attr(*args, **kwds)
+        finally:
+          self._finished()
+      if name in ['get_recording', 'get_signal']: self._attach(result)
+      return result
+    return limited
+
+  def _started(self, read=False):
+  #------------------------------
+    with self._lock:
+      self.requests += 1
+      if read: self.reads += 1
+      self.in_flight += 1
+
+  def _finished(self):
+  #-------------------
+    with self._lock:
+      self.in_flight -= 1
+
+  def _attach(self, resource):
+  #---------------------------
+    """
+    Have a recording, or signal, and a recording's signals, read their
+    data through us instead of directly from the client.
+    """
+    if getattr(resource, 'repository', None) is self._repository:
+      resource.repository = self
+    signals = getattr(resource, 'signals', None)
+    if signals is not None:
+      for s in signals():
+        if getattr(s, 'repository', None) is self._repository: s.repository = self
+
+  def _store_request(self, store):
+  #-------------------------------
+    """
+    A replacement for the SPARQL store's method of making a request,
+    using pooled sessions.
+    """
+    def request(endpoint, method, body=None, headers=None):
+      if store._port is None: url = store._href + endpoint
+      else:                   url = store._href + ':' + str(store._port) + endpoint
+      try:
+        (response, content) = self._sessions.request(url, body=body, method=method, headers=headers)
+      except socket.error:
+        raise StoreException("Cannot connect to SPARQL endpoint: %s" % url)
+      if response.status not in [200, 201]:
+        raise StoreException('SPARQL error: %s' % store._error_text(response, content))
+      return content
+    return request
+
+  def close(self):
+  #---------------
+    self._sessions.close()
+    self._repository.close()
+
+
+_STORE_REQUEST = [ 'endpoint', 'method', 'body', 'headers' ]
+
+def _poolable(store):
+#====================
+  """
+  Whether a SPARQL store's requests can be made using pooled sessions.
+
+  biosignalml's SPARQL store makes each request with a new ``httplib2``
+  session, and so a new connection, and has no public way of supplying
+  a session. Pooling therefore replaces its private ``_request`` method,
+  which is only done if that method, and the attributes used in its
+  place, are as expected.
+  """
+  request = getattr(store, '_request', None)
+  try:
+    args = inspect.getargspec(request).args
+  except (TypeError, AttributeError):
+    try:
+      args = inspect.getfullargspec(request).args
+    except (TypeError, AttributeError):
+      args = None
+  if (args is None or args[1:] != _STORE_REQUEST
+   or not all(hasattr(store, a) for a in ['_href', '_port', '_error_text'])):
+    logging.warning("SPARQL store %s doesn't make requests as expected, not pooling its sessions",
+                    type(store).__name__)
+    return False
+  return True
+
+
+_connections = { }        # base URL --> (RepositoryConnection, CachedRepository)
+_connecting = { }         # base URL --> Lock held while connecting
+_opened = 0
+_lock = threading.Lock()
+
+def _connecting_lock(base):
+#==========================
+  with _lock:
+    return _connecting.setdefault(base, threading.Lock())
+
+
+def repository(uri, username=None, password=None):
+#=================================================
+  """
+  The shared client of the repository holding `uri`, connecting to the
+  repository the first time it's used or when credentials are given.
+
+  Connecting doesn't hold up callers using other repositories, nor
+  :func:`known_repository`.
+
+  :return: A :class:`~metacache.CachedRepository`.
+  """
+  global _opened
+  base = base_url(uri)
+  with _connecting_lock(base):
+    if username is None:
+      with _lock:
+        if base in _connections: return _connections[base][1]
+      connection = RepositoryConnection(client.Repository(base))
+    else:
+      connection = RepositoryConnection(client.Repository(base, username, password))
+    # A replaced client isn't closed, as what it has returned may still be reading through it
+    with _lock:
+      _connections[base] = (connection, CachedRepository(connection))
+      _opened += 1
+      return _connections[base][1]
+
+
+def known_repository(uri):
+#=========================
+  """
+  Whether `uri` is in a repository that has been connected to, either in
+  this process or previously with credentials.
+  """
+  base = base_url(uri)
+  with _lock:
+    if base in _connections: return True
+  try:
+    return base in [ base_url(r) for r in client.Repository.known_repositories() ]
+  except Exception:
+    return False
+
+
+def connection_counters():
+#=========================
+  """
+  :return: A dictionary of the number of clients opened and held, of HTTP sessions created, and of calls and data reads made
+    and in progress, over all repositories.
+  """
+  with _lock:
+    connections = [ c[0] for c in _connections.values() ]
+    return { 'opened': _opened, 'connections': len(connections),
+             'sessions': sum(c._sessions.created for c in connections),
+             'requests': sum(c.requests for c in connections),
+             'reads': sum(c.reads for c in connections),
+             'in_flight': sum(c.in_flight for c in connections) }
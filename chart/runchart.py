@@ -1,6 +1,10 @@
+import os
 import sys
 import re
+import time
+import atexit
 import logging
+import threading
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
@@ -8,12 +12,25 @@ from ui.chart      import Ui_Chart
 from ui.controller import Ui_Controller
 
 from biosignalml import BSML
-from biosignalml.data import DataSegment
 import biosignalml.model
 import biosignalml.units as uom
 
 from nrange import NumericRange
 from table import SortedTable
+from blockcache import BlockCache, CACHE_SIZE, block_duration, block_starts
+from diskcache import DiskCache
+from fetcher import FetchToken, WindowFetch, FETCH_LANES, resolution, read_segments
+from ingest import IngestQueue
+from eventrows import event_rows, event_pages
+from repositories import repository, connection_counters
+
+
+FETCH_THREADS    = 4      # Threads reading signal data
+PREFETCH_WINDOWS = 2      # Windows to prefetch when scrolling quickly
+FAST_SCROLL      = 1.0    # Seconds between moves when scrolling quickly
+PREFETCH_BUDGET  = 0.25   # Fraction of cache a prefetch request may fill
+PREFETCH_PRIORITY = -1    # Below that of reads for the viewer
+PROGRESSIVE_PASSES = [ 64, 8 ]  # Decimation of passes before the final one when opening
 
 
 def wfdbAnnotation(e):
@@ -57,33 +74,193 @@ def signal_uri(signal):
   else:                      return uri
 
 
-class SignalReadThread(QtCore.QThread):
-#======================================
+def add_signal_plot(chart, signal, annotator=wfdbAnnotation):
+#=============================================================
+  """
+  Add a plot for a signal to a chart, as an event plot if
+  the signal holds annotation data.
+  """
+  uri = signal_uri(signal)
+  if str(signal.units) == str(uom.UNITS.AnnotationData.uri):
+    chart.addEventPlot(uri, signal.label, annotator)
+  else:
+    try: units = uom.RESOURCES[str(signal.units)].label
+    except: units = str(signal.units)
+    chart.addSignalPlot(uri, signal.label, units) ## , ymin=signal.minValue, ymax=signal.maxValue)
 
-  append_points = QtCore.pyqtSignal(str, DataSegment)
 
-  def __init__(self, sig, interval, plotter):
-  #------------------------------------------
-    QtCore.QThread.__init__(self)
-    self._signal = sig
-    self._id = signal_uri(sig)
-    self._interval = interval
-    self.append_points.connect(plotter.ui.chart.appendData)
+_fetchpool = None
+
+def fetch_pool():
+#================
+  """
+  The thread pool, shared by all controllers, that reads signal data.
+  """
+  global _fetchpool
+  if _fetchpool is None:
+    _fetchpool = QtCore.QThreadPool()
+    _fetchpool.setMaxThreadCount(FETCH_THREADS)
+  return _fetchpool
+
+
+_diskcache = None
+
+def disk_cache():
+#================
+  """
+  The cache, shared by all controllers, that keeps signal data on disk
+  between sessions.
+  """
+  global _diskcache
+  if _diskcache is None:
+    path = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.CacheLocation)
+    _diskcache = DiskCache(os.path.join(path, 'blocks'))
+    atexit.register(_diskcache.flush)
+  return _diskcache
+
+
+class FetchLane(QtCore.QRunnable):
+#=================================
+
+  def __init__(self, fetch, bridge):
+  #---------------------------------
+    QtCore.QRunnable.__init__(self)
+    self._fetch = fetch
+    self._bridge = bridge       # Keeps the QObject alive while we run
+
+  def run(self):
+  #-------------
+    self._fetch.run_lane()
+
+
+class PrefetchRequest(FetchToken):
+#=================================
+  """
+  The windows a :class:`PrefetchTask` is to read, nearest first.
+
+  :param direction: +1 when prefetching forwards in time, -1 when backwards.
+  """
+
+  def __init__(self, direction):
+  #-----------------------------
+    FetchToken.__init__(self, 0)
+    self.direction = direction
+    self._lock = threading.Lock()
+    self._pending = None
+    self._done = False
+
+  @property
+  def pending(self):
+  #-----------------
+    return self._pending is not None
+
+  def prefetch(self, windows):
+  #---------------------------
+    """
+    Replace the windows waiting to be read.
+
+    :param windows: A list of (start, end) tuples.
+    :return: False if the request has finished and can't take more windows.
+    """
+    with self._lock:
+      if self._done or self.cancelled: return False
+      self._pending = windows
+      return True
+
+  def take(self):
+  #--------------
+    """
+    Get the windows waiting to be read, or None, marking the request
+    as finished, if there are none.
+    """
+    with self._lock:
+      (windows, self._pending) = (self._pending, None)
+      if windows is None or self.cancelled:
+        self._done = True
+        return None
+      return windows
+
+
+class PrefetchTask(QtCore.QRunnable):
+#====================================
+  """
+  Read blocks of signals into the cache, ahead of the viewer.
+  Each set of windows requested adds at most `budget` bytes to the cache.
+  Blocks are those the viewer reads for windows of `window` seconds.
+  """
+
+  def __init__(self, signals, cache, budget, request, needed=None, window=None):
+  #-----------------------------------------------------------------------------
+    QtCore.QRunnable.__init__(self)
+    self._signals = signals
+    self._cache = cache
+    self._budget = budget
+    self._request = request
+    self._needed = needed
+    self._window = window
 
   def run(self):
   #-------------
-    self._exit = False
-    self.append_points.emit(self._id, DataSegment(0, None))
     try:
-      for d in self._signal.read(self._interval, maxpoints=20000):
-        self.append_points.emit(self._id, d)
-        if self._exit: break
+      while True:
+        windows = self._request.take()
+        if windows is None: return
+        self._fetch(windows)
     except Exception as msg:
       logging.error(msg)
+      self._request.cancel()
 
-  def stop(self):
-  #--------------
-    self._exit = True
+  def _fetch(self, windows):
+  #-------------------------
+    request = self._request
+    fetched = 0
+    for (start, end) in windows:
+      for signal in self._signals:
+        rate = resolution(getattr(signal, 'rate', None), self._needed)
+        duration = block_duration(rate, self._window)
+        uri = str(signal.uri)
+        blocks = list(block_starts(start, end, duration))
+        if request.direction < 0: blocks.reverse()
+        for block in blocks:
+          key = (uri, block, rate, duration)
+          if key in self._cache: continue
+          segments = [ ]
+          for d in read_segments(signal, signal.recording.interval(block, duration), rate):
+            segments.append(d)
+            if request.cancelled: return
+          fetched += self._cache.put(key, segments)
+          if fetched >= self._budget or request.pending: return
+
+
+class EventQuery(QtCore.QObject):
+#================================
+  """
+  Carries pages of events read by an :class:`EventQueryTask` to the GUI thread.
+  """
+  rows = QtCore.pyqtSignal(int, object)    # A list of EventRows
+
+
+class EventQueryTask(QtCore.QRunnable):
+#======================================
+  """
+  Read a recording's events a page at a time, until cancelled.
+  """
+
+  def __init__(self, token, bridge, store, uri, eventtype, timetype, graph_uri):
+  #-----------------------------------------------------------------------------
+    QtCore.QRunnable.__init__(self)
+    self._token = token
+    self._bridge = bridge
+    self._query = (store, uri, eventtype, timetype, graph_uri)
+
+  def run(self):
+  #-------------
+    try:
+      for rows in event_pages(*self._query):
+        if self._token.cancelled: return
+        self._bridge.rows.emit(self._token.generation, rows)
+    except Exception as msg:
+      logging.error(msg)
 
 
 class ChartForm(QtWidgets.QWidget):
@@ -121,6 +298,19 @@ class ChartForm(QtWidgets.QWidget):
   #-------------------------
     self.ui.chart.setMarker(time)
 
+  def scrollToTime(self, start, end=None):
+  #---------------------------------------
+    """
+    Scroll a zoomed in chart to centre a time, or time range, within
+    the visible part of the chart.
+    """
+    chart = self.ui.chart
+    scroll = self.ui.timescroll
+    (shown, shownend) = chart.timeRange()
+    middle = start if end is None else (start + end)/2.0
+    offset = middle - (shownend - shown)/2.0 - chart.start
+    scroll.setValue(int(offset*(scroll.maximum() + scroll.pageStep())/float(chart.duration)))
+
   def addSignalPlot(self, id, label, units, visible=True, data=None, ymin=None, ymax=None):
   #----------------------------------------------------------------------------------------
     self.ui.chart.addSignalPlot(id, label, units, visible=visible, data=data, ymin=ymin, ymax=ymax)
@@ -311,11 +501,37 @@ class AnnotationTable(object):
     return [str(uri)] + times + [ type, text, tagtext ]
 
 
+class EventTableRow(object):
+#===========================
+  """
+  A row of the annotation table for an event, with column values
+  worked out when they're displayed or sorted on.
+  """
+  __slots__ = ('_event', '_timerange')
+
+  def __init__(self, event, timerange):
+  #------------------------------------
+    self._event = event
+    self._timerange = timerange
+
+  def __getitem__(self, column):
+  #-----------------------------
+    e = self._event
+    if   column == 0: return e.uri
+    elif column == 1: return self._timerange.map(e.start)
+    elif column == 2: return self._timerange.map(e.end)
+    elif column == 3: return e.duration
+    elif column == 4: return 'Event'
+    elif column == 5: return abbreviate_uri(e.eventtype)
+    elif column == 6: return ''
+    raise IndexError(column)
+
+
 class Controller(QtWidgets.QWidget):
 #===================================
 
-  def __init__(self, store, rec_uri, recording=None, parent=None):
-  #---------------------------------------------------------------
+  def __init__(self, store, rec_uri, recording=None, parent=None, cachesize=CACHE_SIZE):
+  #-------------------------------------------------------------------------------------
     QtWidgets.QWidget.__init__(self, parent) # , QtCore.Qt.CustomizeWindowHint
 #                                       | QtCore.Qt.WindowMinMaxButtonsHint
 #                           #           | QtCore.Qt.WindowStaysOnTopHint
@@ -325,7 +541,22 @@ class Controller(QtWidgets.QWidget):
     self.controller = Ui_Controller()
     self.controller.setupUi(self)
     self._graphstore = store
-    self._readers = [ ]
+    self._token = FetchToken(0)
+    self._interval = None                 # Being read
+    self._needed = None                   # Samples a second needed for the window
+    self._reading = None                  # Samples a second of the pass being read
+    self._passes = [ ]                    # Samples a second of passes still to read
+    self._completed = set()               # Signals read by the current pass
+    self._loaded = { }                    # signal id --> (interval, needed) completely read
+    self._refiner = None                  # Reading the window or visible part at a higher rate
+    self._refine_pending = False
+    self._fetched = IngestQueue()
+    self._fetched.append_points.connect(self._append_points)
+    self._fetched.trim_points.connect(self._trim_points)
+    self._fetched.replace_points.connect(self._replace_points)
+    self._fetched.read_completed.connect(self._read_completed)
+    self._prefetcher = None
+    self._moved = 0.0                     # When the viewer last moved
 
     start = 0.0
     end = None
@@ -348,6 +579,8 @@ class Controller(QtWidgets.QWidget):
     if self._recording is None:
       raise IOError("Unknown recording: %s" % rec_uri)
     self.uri = str(self._recording.uri)
+    disk_cache().open_recording(self.uri, self._recording.graph)
+    self._cache = BlockCache(cachesize, disk_cache(), self.uri)   # Of signal data already read
     self.setWindowTitle(self.uri)
     self._make_uri = self._recording.uri.make_uri    # Method for minting new URIs
 
@@ -386,9 +619,8 @@ class Controller(QtWidgets.QWidget):
                                  a.comment if a.comment is not None else '',
                                  a.tags, True, a) )
 ##      print (str(a.uri), annstart, annend, str(a.comment), a.tags)
-    for e in [store.get_event(evt, self._recording.graph)
-                for evt in store.get_event_uris(rec_uri, timetype=BSML.Interval, graph_uri=self._recording.graph)]:
-      self._annotations.append( (str(e.uri), e.time.start, e.time.end, abbreviate_uri(e.eventtype), None, False, e) )
+    for e in event_rows(store, rec_uri, timetype=BSML.Interval, graph_uri=self._recording.graph):
+      self._annotations.append( (e.uri, e.start, e.end, abbreviate_uri(e.eventtype), None, False, e) )
 
     self._annotation_table = SortedTable(self.controller.annotations, AnnotationTable.header(),
                                          [ AnnotationTable.row(a[0], self._make_ann_times(a[1], a[2]),
@@ -398,7 +630,10 @@ class Controller(QtWidgets.QWidget):
                                          parent=self)
     self._events = { }
     self._event_type = None
-    self._event_rows = None
+    self._event_rows = set()              # Keys of event rows in the annotation table
+    self._event_query = FetchToken(0)
+    self._event_pages = EventQuery()
+    self._event_pages.rows.connect(self._add_events)
     self.controller.events.addItem('None')
     self.controller.events.insertItems(1, ['%s (%s)' % (abbreviate_uri(etype), count)
       for etype, count in store.event_types(rec_uri, counts=True, graph_uri=self._recording.graph)])
@@ -418,20 +653,15 @@ class Controller(QtWidgets.QWidget):
     self.viewer.ui.chart.annotationModified.connect(self.annotationModified)
     self.viewer.ui.chart.annotationDeleted.connect(self.annotationDeleted)
     self.viewer.ui.chart.exportRecording.connect(self.exportRecording)
+    self.viewer.ui.chart.timeRangeChanged.connect(self._refine)
 
     self.viewer.setSemanticTags(self.semantic_tags)
 
     interval = self._recording.interval(self._start, self._duration)
     self._setup_slider()
     for s in self._recording.signals():
-      uri = signal_uri(s)
-      if str(s.units) == str(uom.UNITS.AnnotationData.uri):
-        self.viewer.addEventPlot(uri, s.label, annotator)
-      else:
-        try: units = uom.RESOURCES[str(s.units)].label
-        except: units = str(s.units)
-        self.viewer.addSignalPlot(uri, s.label, units) ## , ymin=s.minValue, ymax=s.maxValue)
-    self._plot_signals(interval)
+      add_signal_plot(self.viewer, s, annotator)
+    self._plot_signals(interval, progressive=True)
     for a in self._annotations:  # tuple(uri, start, end, text, tags, resource)
       if a[1] is not None: self.viewer.addAnnotation(*a[:6])
     # self.setFocusPolicy(QtCore.Qt.StrongFocus) # Needed to handle key events
@@ -440,24 +670,170 @@ class Controller(QtWidgets.QWidget):
   def __del__(self):
   #-----------------
     self._stop_readers()
-
-  def _plot_signals(self, interval):
-  #---------------------------------
+    self._stop_prefetch()
+    self._event_query.cancel()
+    disk_cache().flush()
+
+  def _plot_signals(self, interval, progressive=False):
+  #----------------------------------------------------
+    """
+    Start reading signals for an interval. Where a signal's data for the
+    previous interval was completely read, only newly exposed data is read.
+
+    When `progressive`, a heavily decimated overview is read first and
+    is then replaced, a pass at a time, by finer data, with the final
+    pass at the rate the window needs. Overview passes only read the
+    window, so nothing outside it is left once the final pass is read.
+    """
+    loaded = self._loaded
     self._stop_readers()
+    self._fetched.reset()
+    self._needed = self.viewer.ui.chart.displayRate(self._duration)
+    self._passes = [ self._needed/float(d) for d in PROGRESSIVE_PASSES ] if progressive else [ ]
+    self._passes.append(self._needed)
+    self._reading = self._passes.pop(0)
+    signals = [ (signal_uri(s), s, loaded.get(signal_uri(s))) for s in self._recording.signals() ]
+    self._token = WindowFetch(self._token.generation + 1, signals, interval,
+                              self._cache, self._fetched, self._reading,
+                              final=self._needed if self._passes else None)
+    self._interval = interval
+    self._loaded = { }
+    self._completed = set()
     self.viewer.resetAnnotations()
-    for s in self._recording.signals():
-      self._readers.append(SignalReadThread(s, interval, self.viewer))
-      self._readers[-1].start()
+    pool = fetch_pool()
+    for n in range(min(FETCH_LANES, len(signals))):
+      pool.start(FetchLane(self._token, self._fetched))
+
+  def _next_pass(self):
+  #--------------------
+    """
+    Replace the window's data with that of the next, finer, pass.
+    """
+    while self._passes:
+      previous = self._reading
+      self._reading = self._passes.pop(0)
+      self._completed = set()
+      refine = [ ]
+      for s in self._recording.signals():
+        rate = getattr(s, 'rate', None)
+        if rate and resolution(rate, self._reading) > resolution(rate, previous):
+          refine.append((signal_uri(s), s, None))
+        else:
+          self._signal_read(signal_uri(s))
+      if refine:
+        self._refiner = WindowFetch(self._token.generation, refine, self._interval,
+                                    self._cache, self._fetched, self._reading, replace=True,
+                                    final=self._needed if self._passes else None)
+        pool = fetch_pool()
+        for n in range(min(FETCH_LANES, len(refine))):
+          pool.start(FetchLane(self._refiner, self._fetched))
+        return
+
+  @property
+  def _window_read(self):
+  #----------------------
+    return not self._passes and len(self._completed) == len(self._recording.signals())
 
   def _stop_readers(self):
   #-----------------------
-    for t in self._readers: t.stop()
-    while True:
-      stopped = True
-      for t in self._readers:
-        stopped = stopped and t.wait(10)
-      if stopped: break
-    self._readers = [ ]
+    """
+    Cancel reads, without waiting for them to stop.
+    """
+    self._token.cancel()
+    if self._refiner is not None:
+      self._refiner.cancel()
+      self._refiner = None
+
+  def _append_points(self, generation, id, segments):
+  #--------------------------------------------------
+    if generation == self._token.generation:
+      self.viewer.ui.chart.appendSegments(id, segments)
+
+  def _trim_points(self, generation, id, start, end):
+  #--------------------------------------------------
+    if generation == self._token.generation:
+      self.viewer.ui.chart.trimData(id, start, end)
+
+  def _replace_points(self, generation, id, start, end, segments):
+  #---------------------------------------------------------------
+    if generation == self._token.generation:
+      self.viewer.ui.chart.replaceData(id, start, end, segments)
+
+  def _read_completed(self, generation, id):
+  #-----------------------------------------
+    if generation == self._token.generation:
+      self._signal_read(id)
+      if len(self._completed) < len(self._recording.signals()): return
+      self._next_pass()
+      if self._window_read:
+        logging.debug("Window read, ingest: %s, repositories: %s",
+                      self._fetched.counters(), connection_counters())
+        if self._refine_pending: self._refine(*self.viewer.ui.chart.timeRange())
+
+  def _signal_read(self, id):
+  #--------------------------
+    self._completed.add(id)
+    self._loaded[id] = (self._interval, self._reading)
+
+  def _refine(self, start, end):
+  #-----------------------------
+    """
+    When zooming in has left signals with too few samples for the visible
+    time range, read the range again at a higher rate. Waits until the
+    window has been read, so that refined data isn't mixed with the window's.
+    """
+    self._refine_pending = not self._window_read
+    if self._refine_pending: return     # Refining starts once the window is read
+    if self._refiner is not None:
+      self._refiner.cancel()
+      self._refiner = None
+    if end <= start: return
+    needed = self.viewer.ui.chart.displayRate()
+    refine = [ ]
+    for s in self._recording.signals():
+      rate = getattr(s, 'rate', None)
+      if rate and resolution(rate, needed) > resolution(rate, self._needed):
+        refine.append((signal_uri(s), s, None))
+    if not refine: return
+    self._refiner = WindowFetch(self._token.generation, refine,
+                                self._recording.interval(start, end - start),
+                                self._cache, self._fetched, needed, replace=True, complete=False)
+    pool = fetch_pool()
+    for n in range(min(FETCH_LANES, len(refine))):
+      pool.start(FetchLane(self._refiner, self._fetched))
+
+  def _prefetch(self, start, direction, fast):
+  #-------------------------------------------
+    """
+    Prefetch the window or, when scrolling `fast`, two windows following
+    the viewer in the direction it is moving.
+    """
+    count = PREFETCH_WINDOWS if fast else 1
+    windows = [ ]
+    for n in range(1, count + 1):
+      wstart = start + direction*n*self._duration
+      wend = min(wstart + self._duration, self._recording.duration)
+      wstart = max(0.0, wstart)
+      if wstart < wend: windows.append((wstart, wend))
+    if not windows: return
+    if (self._prefetcher is not None and self._prefetcher.direction == direction
+     and self._prefetcher.prefetch(windows)): return
+    self._stop_prefetch()
+    self._prefetcher = PrefetchRequest(direction)
+    self._prefetcher.prefetch(windows)
+    fetch_pool().start(PrefetchTask(list(self._recording.signals()), self._cache,
+                                    PREFETCH_BUDGET*self._cache.size, self._prefetcher,
+                                    self._needed, self._duration),
+                       PREFETCH_PRIORITY)
+
+  def _stop_prefetch(self):
+  #------------------------
+    """
+    Cancel prefetching, without waiting for the current read to finish.
+    """
+    if self._prefetcher is not None:
+      self._prefetcher.cancel()
+      self._prefetcher = None
 
   def _make_ann_times(self, start, end):
   #-------------------------------------
@@ -570,11 +946,16 @@ class Controller(QtWidgets.QWidget):
   def _move_viewer(self, start):
   #-----------------------------
     if start != self._start:
+      direction = 1 if start > self._start else -1
+      now = time.time()
+      fast = (now - self._moved) < FAST_SCROLL
+      self._moved = now
       self._plot_signals(self._recording.interval(start, self._duration))
       self.viewer.setTimeRange(start, self._duration)
       self._start = start
       for a in self._annotations:  # tuple(uri, start, end, text, tags, resource)
         if a[1] is not None: self.viewer.addAnnotation(*a[:6])
+      self._prefetch(start, direction, fast)
 
   def on_segment_valueChanged(self, position):
   #-------------------------------------------
@@ -620,39 +1001,49 @@ class Controller(QtWidgets.QWidget):
         time = evt[0]
         duration = evt[1]
     if time is not None:
-      if duration is not None:
-        start = max(0.0, time - duration/2.0)
-        end = min(time + duration + duration/2.0, self._recording.duration)
-        self._duration = end - start
-      else:
-        start = max(0.0, time - self._duration/4.0)
-      self._move_viewer(start)
-      self._set_slider_value(start)
-      self._show_slider_time(start)
+      end = time + duration if duration is not None else time
+      (shown, shownend) = self.viewer.ui.chart.timeRange()
+      if shown <= time and end <= shownend:
+        self.viewer.setMarker(time)       # Already visible
+        return
+      if not (self._start <= time and end <= (self._start + self._duration)):
+        if duration is not None:
+          start = max(0.0, time - duration/2.0)
+          windowend = min(time + duration + duration/2.0, self._recording.duration)
+          self._duration = windowend - start
+        else:
+          start = max(0.0, time - self._duration/4.0)
+        self._move_viewer(start)
+        self._set_slider_value(start)
+        self._show_slider_time(start)
+      self.viewer.scrollToTime(time, end)   # When zoomed in
       self.viewer.setMarker(time)
 
   def on_events_currentIndexChanged(self, index):
   #----------------------------------------------
     if (self._event_type is None      # Setting up
      or not isinstance(index, basestring)): return
-    if self._event_rows is not None:
+    self._event_query.cancel()
+    if self._event_rows:
       self._annotation_table.removeRows(self._event_rows)
-    if index == 'None':
-      self._event_rows = None
-      return
+      self._event_rows = set()
+    self._events = { }
+    if index == 'None': return
     if index == 'All': etype = None
     else: etype = expand_uri(str(index).rsplit(' (', 1)[0])
-    events = [ self._graphstore.get_event(evt, self._recording.graph)
-                 for evt in self._graphstore.events(self.uri, eventtype=etype,
-                                                    timetype=BSML.Instant, graph_uri=self._recording.graph) ]
-    self._events = { str(event.uri): (event.time.start, event.time.duration) for event in events }
-    self._event_rows = self._annotation_table.appendRows([ AnnotationTable.row(event.uri,
-                                                            [self._timerange.map(event.time.start),
-                                                             self._timerange.map(event.time.end),
-                                                             event.time.duration], 'Event',
-                                                            abbreviate_uri(event.eventtype))
-                                                         for event in events ])
-    self._adjust_layout()
+    self._event_query = FetchToken(self._event_query.generation + 1)
+    fetch_pool().start(EventQueryTask(self._event_query, self._event_pages, self._graphstore,
+                                      self.uri, etype, BSML.Instant, self._recording.graph))
+
+  def _add_events(self, generation, events):
+  #-----------------------------------------
+    if generation != self._event_query.generation or not events: return
+    for event in events: self._events[event.uri] = (event.start, event.duration)
+    first = not self._event_rows
+    self._annotation_table.appendRows([ EventTableRow(event, self._timerange)
+                                          for event in events ])
+    self._event_rows.update(str(event.uri) for event in events)
+    if first: self._adjust_layout()
 
   def annotationAdded(self, start, end, text, tags, predecessor=None):
   #-------------------------------------------------------------------
@@ -727,7 +1118,11 @@ def show_chart(store, recording, start=0.0, end=None):
 
 def show_recording(uri, start=0.0, end=None):
 #============================================
-  store = biosignalml.client.Repository(uri)
+  if os.path.exists(uri):           # A local HDF5 file
+    from localstore import LocalStore
+    store = LocalStore(uri)
+  else:
+    store = repository(uri)
   try:
     ctlr = Controller(store, "%s#t=%g,%s" % (uri, start, end if end is not None else ''))
   except IOError as msg:
@@ -740,14 +1135,12 @@ def show_recording(uri, start=0.0, end=None):
 if __name__ == "__main__":
 #=========================
 
-  import biosignalml.client
-
   logging.basicConfig(format='%(asctime)s %(levelname)8s %(threadName)s: %(message)s')
   logging.getLogger().setLevel('DEBUG')
 
   ## Replace following with Python arg parser...
   if len(sys.argv) <= 1:
-    print("Usage: %s recording_uri [start] [duration]" % sys.argv[0])
+    print("Usage: %s recording_uri_or_file [start] [duration]" % sys.argv[0])
     sys.exit(1)
 
   app = QtWidgets.QApplication(sys.argv)
@@ -0,0 +1,207 @@
+"""
+A stand-in repository, serving synthetic signal data over HTTP from a
+local thread, for driving fetches without a real repository.
+
+Each signal is uniformly sampled, with the value of sample ``n`` of
+signal ``k`` being ``1000000*k + n``, so that what a reader receives
+can be checked against the samples it asked for. Signals read data in
+requests of at most `maxpoints` samples, made through a
+:class:`~repositories.SessionPool` so that connections are kept alive
+and reused. The server counts the connections and requests it sees.
+
+Usage::
+
+  server = StandinServer()
+  recording = server.recording([ 500.0, 250.0 ], duration=600.0)
+  for d in recording.signals()[0].read(recording.interval(0.0, 10.0), maxpoints=1000):
+    ...
+  server.close()
+"""
+
+import math
+import threading
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+  from urlparse import urlparse, parse_qs
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+  from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from biosignalml.data import DataSegment, UniformTimeSeries
+
+from repositories import SessionPool
+
+
+SAMPLE_OFFSET = 1000000   # Between the values of consecutive signals
+
+
+def sample_values(signal, first, count, step):
+#=============================================
+  """
+  The values of every `step`'th sample of a stand-in signal, from
+  sample `first`.
+  """
+  return SAMPLE_OFFSET*signal + first + step*np.arange(count, dtype=np.float64)
+
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+#===================================================
+
+  protocol_version = 'HTTP/1.1'   # So connections are kept alive
+
+  def setup(self):
+  #---------------
+    BaseHTTPRequestHandler.setup(self)
+    self.server.counted('connections')
+
+  def do_GET(self):
+  #----------------
+    url = urlparse(self.path)
+    if url.path != '/data':
+      self.send_error(404)
+      return
+    self.server.counted('requests')
+    params = parse_qs(url.query)
+    try:
+      values = sample_values(*[ int(params[p][0]) for p in ['signal', 'first', 'count', 'step'] ])
+    except (KeyError, ValueError) as msg:
+      self.send_error(400, "Invalid request: %s" % msg)
+      return
+    content = values.tobytes()
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/octet-stream')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, format, *args):
+  #------------------------------------
+    pass
+
+
+class StandinInterval(object):
+#=============================
+
+  def __init__(self, start, duration):
+  #-----------------------------------
+    self.start = start
+    self.duration = duration
+    self.end = start + duration
+
+
+class StandinRecording(object):
+#==============================
+  """
+  A recording of stand-in signals, read from a :class:`StandinServer`.
+  """
+
+  def __init__(self, url, rates, duration):
+  #----------------------------------------
+    self.uri = url + '/recording'
+    self.duration = duration
+    self._sessions = SessionPool()
+    self._signals = [ StandinSignal(self, n, rate) for n, rate in enumerate(rates) ]
+    self._url = url
+
+  def signals(self):
+  #-----------------
+    return self._signals
+
+  def interval(self, start, duration=None, end=None):
+  #--------------------------------------------------
+    return StandinInterval(start, duration if duration is not None else end - start)
+
+  def get(self, signal, first, count, step):
+  #-----------------------------------------
+    (response, content) = self._sessions.request(
+      '%s/data?signal=%d&first=%d&count=%d&step=%d' % (self._url, signal, first, count, step))
+    if response.status != 200: raise IOError("Stand-in server error: %s" % response.reason)
+    return np.frombuffer(content, dtype=np.float64)
+
+  def close(self):
+  #---------------
+    self._sessions.close()
+
+
+class StandinSignal(object):
+#===========================
+  """
+  A signal whose reads are requests to a :class:`StandinServer`. Reads
+  at a lower `rate` take every n'th sample, as local files do.
+  """
+
+  def __init__(self, recording, number, rate):
+  #-------------------------------------------
+    self.recording = recording
+    self.number = number
+    self.rate = rate
+    self.uri = '%s/signal/%d' % (recording.uri, number)
+
+  def read(self, interval=None, maxpoints=None, rate=None, **kwds):
+  #----------------------------------------------------------------
+    if interval is None: interval = self.recording.interval(0.0, self.recording.duration)
+    step = max(1, int(self.rate/rate)) if rate else 1
+    first = max(0, int(math.ceil(interval.start*self.rate)))
+    last = min(int(math.ceil(self.recording.duration*self.rate)),
+               int(math.ceil(interval.end*self.rate)))
+    first = step*int(math.ceil(first/float(step)))
+    chunk = maxpoints if maxpoints else (last - first)
+    for n in range(first, last, chunk*step):
+      count = len(range(n, min(n + chunk*step, last), step))
+      values = self.recording.get(self.number, n, count, step)
+      yield DataSegment(n/self.rate, UniformTimeSeries(values, rate=self.rate/step))
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+#===============================================
+  """
+  Serve stand-in signal data from a background thread, on a free port of
+  the local host.
+  """
+
+  daemon_threads = True
+
+  def __init__(self):
+  #------------------
+    HTTPServer.__init__(self, ('127.0.0.1', 0), StandinRequestHandler)
+    self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+    self._lock = threading.Lock()
+    self._counts = { 'connections': 0, 'requests': 0 }
+    self._recordings = [ ]
+    self._thread = threading.Thread(target=self.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def counted(self, name):
+  #-----------------------
+    with self._lock:
+      self._counts[name] += 1
+
+  def counts(self):
+  #----------------
+    """
+    :return: A dictionary of the number of connections and requests made.
+    """
+    with self._lock:
+      return dict(self._counts)
+
+  def recording(self, rates, duration):
+  #------------------------------------
+    """
+    A recording of signals sampled at `rates`, lasting `duration` seconds.
+    """
+    recording = StandinRecording(self.url, rates, duration)
+    self._recordings.append(recording)
+    return recording
+
+  def close(self):
+  #---------------
+    for recording in self._recordings: recording.close()
+    self.shutdown()
+    self.server_close()
+    self._thread.join()
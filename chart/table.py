@@ -4,9 +4,24 @@ A generic widget and model for working with a table view.
 Selection by row and sortable columns are provided.
 """
 
+import heapq
+
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 
+FETCH_ROWS = 500          # Rows added to a view each time it's scrolled to the end
+
+
+def sort_key(value):
+#===================
+  """
+  Sort numbers before text, with empty cells last.
+  """
+  if value is None or value == '': return (2, '')
+  if isinstance(value, (int, float)): return (0, value)
+  return (1, str(value))
+
+
 class TableView(QtWidgets.QTableView):
 #=====================================
   """
@@ -45,21 +60,30 @@ class TableModel(QtCore.QAbstractTableModel):
 
   :param header (list): A list of column headings.
   :param rows (list): A list of table data rows, with each element
-     a list of the row's column data. The first column is used as
+     a sequence of the row's column data. The first column is used as
      a row identifier and is normally hidden.
+
+  Rows are added to a view a page at a time, as it's scrolled to the
+  end, so that large tables open quickly. The model sorts itself, using
+  an index of row positions for each column that is built the first time
+  the column is sorted on and is then kept up to date as rows are added
+  and removed.
   """
 
   def __init__(self, header, rows, parent=None):
   #---------------------------------------------
     QtCore.QAbstractTableModel.__init__(self, parent)
     self._header = header
-    self._rows = rows
-
+    self._rows = list(rows)               # In the order added
     self._keys = { str(r[0]): n for n, r in enumerate(self._rows) }
+    self._indices = { }                   # column --> sorted (sort key, row position) pairs
+    self._column = None                   # Sorted on
+    self._order = QtCore.Qt.AscendingOrder
+    self._shown = min(len(self._rows), FETCH_ROWS)
 
   def rowCount(self, parent=None):
   #-------------------------------
-    return len(self._rows)
+    return self._shown
 
   def columnCount(self, parent=None):
   #----------------------------------
@@ -80,7 +104,7 @@ class TableModel(QtCore.QAbstractTableModel):
   def data(self, index, role):
   #---------------------------
     if   role == QtCore.Qt.DisplayRole:
-      value = self._rows[index.row()][index.column()]
+      value = self._rows[self._position(index.row())][index.column()]
       return QtCore.QVariant(value) if value is not None else ''
     elif role == QtCore.Qt.TextAlignmentRole:
       return QtCore.Qt.AlignTop
@@ -89,26 +113,132 @@ class TableModel(QtCore.QAbstractTableModel):
   #-----------------------
     return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
 
+  def canFetchMore(self, parent):
+  #------------------------------
+    return self._shown < len(self._rows)
+
+  def fetchMore(self, parent):
+  #---------------------------
+    self._show(FETCH_ROWS)
+
+  def _show(self, count):
+  #----------------------
+    count = min(count, len(self._rows) - self._shown)
+    if count > 0:
+      self.beginInsertRows(QtCore.QModelIndex(), self._shown, self._shown + count - 1)
+      self._shown += count
+      self.endInsertRows()
+
+  def _sorted(self, column, first=0):
+  #----------------------------------
+    rows = self._rows
+    return sorted((sort_key(rows[n][column]), n) for n in range(first, len(rows)))
+
+  def _index(self, column):
+  #------------------------
+    index = self._indices.get(column)
+    if index is None:
+      index = self._indices[column] = self._sorted(column)
+    return index
+
+  def _position(self, row):
+  #------------------------
+    """ The position in `_rows` of a row of the view. """
+    if self._column is None: return row
+    index = self._index(self._column)
+    return index[row if self._order == QtCore.Qt.AscendingOrder else len(index) - row - 1][1]
+
+  def _view_rows(self):
+  #--------------------
+    """ A list giving the view's row for each position in `_rows`. """
+    if self._column is None: return list(range(len(self._rows)))
+    index = self._index(self._column)
+    if self._order != QtCore.Qt.AscendingOrder: index = reversed(index)
+    rows = [ 0 ]*len(self._rows)
+    for row, (key, position) in enumerate(index): rows[position] = row
+    return rows
+
+  def _remove(self, positions):
+  #----------------------------
+    """
+    Remove rows from `_rows`, renumbering the positions held by sort indices.
+    """
+    moved = [ ]                           # old position --> new, or -1 if removed
+    kept = [ ]
+    for n, r in enumerate(self._rows):
+      if n in positions:
+        moved.append(-1)
+      else:
+        moved.append(len(kept))
+        kept.append(r)
+    self._rows = kept
+    self._keys = { str(r[0]): n for n, r in enumerate(self._rows) }
+    self._indices = { column: [ (key, moved[n]) for (key, n) in index if moved[n] >= 0 ]
+                        for column, index in self._indices.items() }
+
+  def _persistent(self):
+  #---------------------
+    return [ (index, self._position(index.row())) for index in self.persistentIndexList() ]
+
+  def _restore(self, persistent):
+  #------------------------------
+    if not persistent: return
+    rows = self._view_rows()
+    for (index, position) in persistent:
+      row = rows[position]
+      self.changePersistentIndex(index, self.index(row, index.column())
+                                        if row < self._shown else QtCore.QModelIndex())
+
+  def sort(self, column, order=QtCore.Qt.AscendingOrder):
+  #------------------------------------------------------
+    self.layoutAboutToBeChanged.emit()
+    persistent = self._persistent()
+    self._column = column
+    self._order = order
+    self._restore(persistent)
+    self.layoutChanged.emit()
+
   def appendRows(self, rows):
   #--------------------------
-    posns = (len(self._rows), len(self._rows) + len(rows) - 1)
-    self.beginInsertRows(self.createIndex(len(self._rows), 0), posns[0], posns[1])
+    """
+    Add rows, showing those that sort into the rows already shown and
+    filling the view's first page. The added rows are merged into each
+    sort index, so rows already in the table aren't sorted again.
+    """
+    first = len(self._rows)
+    self.layoutAboutToBeChanged.emit()
+    persistent = self._persistent()
     self._rows.extend(rows)
-    self._keys = { str(r[0]): n for n, r in enumerate(self._rows) }
-    self.endInsertRows()
-    return posns
+    self._keys.update({ str(r[0]): n for n, r in enumerate(self._rows[first:], first) })
+    for column, index in self._indices.items():
+      self._indices[column] = list(heapq.merge(index, self._sorted(column, first)))
+    self._restore(persistent)
+    self.layoutChanged.emit()
+    self._show(FETCH_ROWS - self._shown)
 
-  def removeRows(self, posns):
-  #---------------------------
-    self.beginRemoveRows(self.createIndex(posns[0], 0), posns[0], posns[1])
-    self._rows[posns[0]:posns[1]+1] = []
-    self._keys = { str(r[0]): n for n, r in enumerate(self._rows) }
-    self.endRemoveRows()
+  def removeRows(self, keys):
+  #--------------------------
+    """
+    Remove the rows identified by `keys`.
+    """
+    positions = set(self._keys[str(k)] for k in keys if str(k) in self._keys)
+    if not positions: return
+    self.beginResetModel()
+    self._remove(positions)
+    self._shown = min(len(self._rows), FETCH_ROWS)
+    self.endResetModel()
 
   def deleteRow(self, key):
   #------------------------
     n = self._keys.get(str(key), -1)
-    if n >= 0: self.removeRows((n, n))
+    if n < 0: return
+    row = self._view_rows()[n]
+    shown = row < self._shown
+    if shown: self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+    self._remove(set([ n ]))
+    if shown:
+      self._shown -= 1
+      self.endRemoveRows()
 
 
 class SortedTable(QtCore.QSortFilterProxyModel):
@@ -123,7 +253,8 @@ class SortedTable(QtCore.QSortFilterProxyModel):
      a row identifier and is hidden.
 
   The initial view of the model is sorted on the second column (i.e. on
-  the first visible column).
+  the first visible column). Sorting is done by the underlying
+  :class:`TableModel`, not by re-sorting rows here.
   """
 
   def __init__(self, view, header, rows, tablefilter=None, parent=None):
@@ -156,22 +287,19 @@ class SortedTable(QtCore.QSortFilterProxyModel):
 #    return (self._filter is None
 #         or self._filter(row, self._table._rows[row]))
 
+  def sort(self, column, order=QtCore.Qt.AscendingOrder):
+  #------------------------------------------------------
+    self._table.sort(column, order)
+
   def appendRows(self, rows):
   #--------------------------
-    self._table.layoutAboutToBeChanged.emit()
-    posns = self._table.appendRows(rows)
-    self._table.layoutChanged.emit()
-    return posns
+    self._table.appendRows(rows)
 
-  def removeRows(self, posns):
-  #---------------------------
-    self._table.layoutAboutToBeChanged.emit()
-    self._table.removeRows(posns)
-    self._table.layoutChanged.emit()
+  def removeRows(self, keys):
+  #--------------------------
+    self._table.removeRows(keys)
 
   def deleteRow(self, key):
   #------------------------
-    self._table.layoutAboutToBeChanged.emit()
     self._table.deleteRow(key)
-    self._table.layoutChanged.emit()
 
@@ -0,0 +1,125 @@
+"""
+Load events with :func:`~eventrows.event_rows` from stand-in stores.
+
+Run with::
+
+  python -m unittest test_eventrows
+"""
+
+import collections
+import unittest
+
+from eventrows import event_rows, seconds
+
+
+RECORDING = 'http://example.org/recording/1'
+EVENT = 'http://example.org/event/'
+BEAT = 'http://example.org/type/beat'
+
+Time = collections.namedtuple('Time', 'start duration')
+Event = collections.namedtuple('Event', 'uri eventtype time')
+
+# (number, start, duration) of each event, in no particular order
+EVENTS = [ (3, 'PT10S', None), (1, 'PT2.5S', 'PT1S'), (4, 'PT1M5S', None),
+           (2, 'PT9S', 'PT0.5S'), (0, 'PT0S', None) ]
+
+
+class SelectStore(object):
+#=========================
+  """
+  A store that answers event queries, a page at a time, from a list of
+  bindings.
+  """
+
+  def __init__(self):
+  #------------------
+    self.queries = [ ]
+    self._bindings = [ ]
+    for (n, start, duration) in EVENTS:
+      binding = { 'event': { 'value': EVENT + str(n) }, 'etype': { 'value': BEAT },
+                  'start': { 'value': start } }
+      if duration is not None: binding['duration'] = { 'value': duration }
+      self._bindings.append(binding)
+
+  def select(self, fields, where, prefixes=None, order=None, limit=None):
+  #----------------------------------------------------------------------
+    self.queries.append(where)
+    (page, offset) = [ int(n) for n in limit.split(' OFFSET ') ]
+    return self._bindings[offset:offset+page]
+
+
+class EventStore(object):
+#========================
+  """
+  A store that can only get events one at a time.
+  """
+
+  def __init__(self):
+  #------------------
+    self.got = [ ]
+
+  def get_event_uris(self, recording, timetype=None, graph_uri=None):
+  #------------------------------------------------------------------
+    return [ EVENT + str(n) for (n, start, duration) in EVENTS ]
+
+  def get_event(self, uri, graph_uri=None):
+  #----------------------------------------
+    self.got.append(uri)
+    for (n, start, duration) in EVENTS:
+      if uri == EVENT + str(n):
+        return Event(uri, BEAT, Time(seconds(start), seconds(duration)))
+
+
+class FailingStore(EventStore):
+#==============================
+  """
+  A store whose queries fail.
+  """
+
+  def select(self, *args, **kwds):
+  #-------------------------------
+    raise IOError("Cannot query")
+
+
+class TestEventRows(unittest.TestCase):
+#======================================
+
+  def _check(self, rows):
+  #----------------------
+    self.assertEqual([ e.uri for e in rows ], [ EVENT + str(n) for n in range(len(EVENTS)) ])
+    self.assertEqual([ e.start for e in rows ], [ 0.0, 2.5, 9.0, 10.0, 65.0 ])
+    self.assertEqual([ e.duration for e in rows ], [ None, 1.0, 0.5, None, None ])
+    self.assertEqual([ e.end for e in rows ], [ 0.0, 3.5, 9.5, 10.0, 65.0 ])
+    self.assertTrue(all(e.eventtype == BEAT for e in rows))
+
+  def test_select(self):
+  #---------------------
+    store = SelectStore()
+    self._check(event_rows(store, RECORDING, page=2))
+    self.assertEqual(len(store.queries), 3)
+    where = store.queries[0]
+    self.assertIn('<%s>' % RECORDING, where)
+    for term in [ 'bsml:Instant', 'tl:at ?start', 'bsml:Interval', 'tl:start ?start', 'tl:duration ?duration' ]:
+      self.assertIn(term, where)
+
+  def test_select_type(self):
+  #--------------------------
+    store = SelectStore()
+    event_rows(store, RECORDING, eventtype=BEAT)
+    self.assertIn('FILTER (?etype = <%s>)' % BEAT, store.queries[0])
+
+  def test_one_by_one(self):
+  #-------------------------
+    store = EventStore()
+    self._check(event_rows(store, RECORDING))
+    self.assertEqual(len(store.got), len(EVENTS))
+
+  def test_fallback(self):
+  #-----------------------
+    store = FailingStore()
+    self._check(event_rows(store, RECORDING))
+    self.assertEqual(len(store.got), len(EVENTS))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,174 @@
+"""
+Drive :class:`~fetcher.WindowFetch` against a stand-in repository server.
+
+Run with::
+
+  python -m unittest test_fetcher
+"""
+
+import threading
+import unittest
+
+import numpy as np
+
+from blockcache import BlockCache, block_duration, block_starts
+from fetcher import WindowFetch, FETCH_LANES, resolution
+from standin import StandinServer, SAMPLE_OFFSET
+
+
+RATES = [ 500.0, 250.0, 128.0 ]
+DURATION = 600.0
+
+
+class Sink(object):
+#==================
+  """
+  Record what a fetch sends, for each signal.
+  """
+
+  def __init__(self):
+  #------------------
+    self._lock = threading.Lock()
+    self.calls = { }          # id --> list of (call, args)
+
+  def _add(self, id, call, *args):
+  #-------------------------------
+    with self._lock:
+      self.calls.setdefault(id, []).append((call, args))
+
+  def appendData(self, generation, id, data):
+  #------------------------------------------
+    self._add(id, 'append', data)
+
+  def trimData(self, generation, id, start, end):
+  #----------------------------------------------
+    self._add(id, 'trim', start, end)
+
+  def replaceData(self, generation, id, start, end, segments):
+  #-----------------------------------------------------------
+    self._add(id, 'replace', start, end, segments)
+
+  def completed(self, generation, id):
+  #-----------------------------------
+    self._add(id, 'completed')
+
+  def points(self, id):
+  #--------------------
+    """ The points appended for a signal, as (times, values) arrays. """
+    segments = [ args[0] for (call, args) in self.calls.get(id, []) if call == 'append' and len(args[0]) ]
+    if not segments: return (np.empty(0), np.empty(0))
+    points = np.concatenate([ d.points for d in segments ])
+    return (points[:, 0], points[:, 1])
+
+
+def run_lanes(fetch):
+#====================
+  lanes = [ threading.Thread(target=fetch.run_lane) for n in range(FETCH_LANES) ]
+  for lane in lanes: lane.start()
+  for lane in lanes: lane.join()
+
+
+class TestWindowFetch(unittest.TestCase):
+#========================================
+
+  def setUp(self):
+  #---------------
+    self.server = StandinServer()
+    self.recording = self.server.recording(RATES, DURATION)
+    self.cache = BlockCache()
+
+  def tearDown(self):
+  #------------------
+    self.server.close()
+
+  def fetch(self, interval, needed=None, previous=None, generation=1):
+  #-------------------------------------------------------------------
+    sink = Sink()
+    signals = [ (str(n), s, previous) for n, s in enumerate(self.recording.signals()) ]
+    fetch = WindowFetch(generation, signals, interval, self.cache, sink, needed)
+    run_lanes(fetch)
+    return sink
+
+  def check_samples(self, n, times, values, rate):
+  #-----------------------------------------------
+    signal = self.recording.signals()[n]
+    self.assertTrue(np.all(np.diff(times) > 0.0), "Signal %d isn't in time order" % n)
+    samples = values - SAMPLE_OFFSET*n
+    self.assertTrue(np.allclose(samples, times*signal.rate), "Signal %d has wrong values" % n)
+    step = int(signal.rate/rate)
+    self.assertTrue(np.all(np.diff(samples) == step), "Signal %d has gaps" % n)
+
+  def test_window(self):
+  #---------------------
+    interval = self.recording.interval(100.0, 60.0)
+    sink = self.fetch(interval)
+    for n, s in enumerate(self.recording.signals()):
+      calls = sink.calls[str(n)]
+      self.assertEqual(calls[0][0], 'append')          # Resetting the plot
+      self.assertEqual(len(calls[0][1][0]), 0)
+      self.assertEqual([ c[0] for c in calls ].count('completed'), 1)
+      self.assertEqual(calls[-1][0], 'completed')
+      (times, values) = sink.points(str(n))
+      self.check_samples(n, times, values, s.rate)
+      duration = block_duration(s.rate, interval.end - interval.start)
+      blocks = list(block_starts(interval.start, interval.end, duration))
+      self.assertEqual(times[0], blocks[0])
+      self.assertAlmostEqual(times[-1], blocks[-1] + duration - 1.0/s.rate)
+
+  def test_lower_rate(self):
+  #-------------------------
+    sink = self.fetch(self.recording.interval(100.0, 60.0), needed=50.0)
+    for n, s in enumerate(self.recording.signals()):
+      (times, values) = sink.points(str(n))
+      self.check_samples(n, times, values, resolution(s.rate, 50.0))
+
+  def test_cached(self):
+  #---------------------
+    interval = self.recording.interval(100.0, 60.0)
+    first = self.fetch(interval)
+    requests = self.server.counts()['requests']
+    second = self.fetch(interval, generation=2)
+    self.assertEqual(self.server.counts()['requests'], requests)
+    for n in range(len(RATES)):
+      (times, values) = second.points(str(n))
+      self.assertTrue(np.array_equal(values, first.points(str(n))[1]))
+
+  def test_connections_reused(self):
+  #---------------------------------
+    self.fetch(self.recording.interval(0.0, 300.0))
+    counts = self.server.counts()
+    self.assertLessEqual(counts['connections'], FETCH_LANES)
+    self.assertLess(counts['connections'], counts['requests'])
+
+  def test_scrolled(self):
+  #-----------------------
+    window = 60.0
+    previous = self.recording.interval(100.0, window)
+    self.fetch(previous)
+    interval = self.recording.interval(130.0, window)
+    sink = self.fetch(interval, previous=(previous, None), generation=2)
+    for n, s in enumerate(self.recording.signals()):
+      duration = block_duration(s.rate, window)
+      blocks = list(block_starts(interval.start, interval.end, duration))
+      loaded = set(block_starts(previous.start, previous.end, duration))
+      calls = sink.calls[str(n)]
+      self.assertEqual(calls[0], ('trim', (blocks[0], blocks[-1] + duration)))
+      (times, values) = sink.points(str(n))
+      sent = sorted(set(block_starts(times[0], times[-1], duration))) if len(times) else [ ]
+      self.assertEqual(sent, [ b for b in blocks if b not in loaded ])
+
+  def test_cancelled(self):
+  #------------------------
+    sink = Sink()
+    signals = [ (str(n), s, None) for n, s in enumerate(self.recording.signals()) ]
+    fetch = WindowFetch(1, signals, self.recording.interval(0.0, 60.0), self.cache, sink)
+    fetch.cancel()
+    run_lanes(fetch)
+    self.assertEqual(sink.calls, { })
+    self.assertEqual(self.server.counts()['requests'], 0)
+
+
+if __name__ == '__main__':
+#=========================
+
+  unittest.main()